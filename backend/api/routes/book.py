@@ -99,4 +99,5 @@ async def set_book_uploaded_handler(
   
   book.is_uploaded = True
   book_repository.save(book)
-  post_upload_message_broker.publish_job(PostProcessingJob(book_id=book.id))
\ No newline at end of file
+  post_upload_message_broker.publish_job(PostProcessingJob(
+    book_id=book.id, user_id=user_info.user_id, is_premium=user_info.is_premium))
\ No newline at end of file
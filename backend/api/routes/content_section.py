@@ -1,10 +1,11 @@
 from datetime import datetime, timezone
 from dependency_injector.wiring import inject, Provide
-from fastapi import APIRouter, Response, Depends, status, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Response, Depends, status, HTTPException
 
 from api.settings import Settings
 from api.models.content_section import GetAllContentSectionsResponse, GetContentSectionRangeResponse
 from container.prod import Container
+from content_distill_processing.prefetch_policy import DistillPrefetcher
 from repositories.book_content_section_repository.base import BookContentSectionRepository
 from repositories.book_repository.base import BookRepository
 from shared.authentication.base import UserInfo
@@ -17,8 +18,10 @@ content_section_router = APIRouter()
 @content_section_router.get("/get_content_section", tags=["ContentSection"])
 @inject
 async def get_content_section_range_handler(book_id:str, page_num:int,
+  background_tasks: BackgroundTasks,
   content_section_repository: BookContentSectionRepository = Depends(lambda: Container.book_content_section_repository()),
   book_repository: BookRepository = Depends(lambda: Container.book_repository()),
+  distill_prefetcher: DistillPrefetcher = Depends(lambda: Container.distill_prefetcher()),
   user_info:UserInfo = Depends(Container.token_decoder)):
   """
   Get content section for a page
@@ -31,11 +34,12 @@ async def get_content_section_range_handler(book_id:str, page_num:int,
     raise HTTPException(status_code=404, detail="Content section not generated")
 
   content_section = content_section_repository.get_by_page(
-    book_id, page_num, user_info.user_id)
+    book_id, page_num, user_info.user_id, exclude_pages=True)
   
   if not content_section:
     raise HTTPException(status_code=404, detail="Content section not found")
-  
+
+  background_tasks.add_task(distill_prefetcher.prefetch, book_id, user_info.user_id, page_num)
   return GetContentSectionRangeResponse(start_page=content_section.start_page, end_page=content_section.end_page)
 
 
@@ -1,14 +1,17 @@
+import uuid
+
 from datetime import datetime, timezone
 from dependency_injector.wiring import inject, Provide
-from fastapi import APIRouter, Response, Depends, status, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Response, Depends, status, HTTPException
 
 from api.settings import Settings
 from api.models.distilled_content import GetDistilledContentResponse
 from container.prod import Container
+from content_distill_processing.prefetch_policy import DistillPrefetcher
 from content_distill_processing.processing_service import ContentDistillProcessingJob
-from message_broker.pubsub_message_broker import MessageBroker
+from message_broker.priority_message_broker import JobPriority, PriorityMessageBroker
 from repositories.book_content_section_repository.base import BookContentSectionRepository
-from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus
+from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus, can_acquire_lease, get_lease_expiry
 from shared.authentication.base import UserInfo
 
 
@@ -19,9 +22,12 @@ distilled_content_router = APIRouter()
 @distilled_content_router.get("/get_distilled_content", tags=["DistilledContent"])
 @inject
 async def get_distilled_content_handler(book_id: str, start_page: int, end_page: int,
+  background_tasks: BackgroundTasks,
+  allow_partial: bool = False,
   book_distilled_page_repository: BookDistilledPageRepository = Depends(lambda: Container.book_distilled_page_repository()),
   content_section_repository: BookContentSectionRepository = Depends(lambda: Container.book_content_section_repository()),
-  message_broker: MessageBroker = Depends(lambda: Container.content_distill_message_broker()),
+  message_broker: PriorityMessageBroker = Depends(lambda: Container.content_distill_message_broker()),
+  distill_prefetcher: DistillPrefetcher = Depends(lambda: Container.distill_prefetcher()),
   user_info:UserInfo = Depends(Container.token_decoder)):
   """
   Collect usser feedback on content
@@ -31,23 +37,52 @@ async def get_distilled_content_handler(book_id: str, start_page: int, end_page:
   
   if not distilled_page:
     content_sections = content_section_repository.get_by_range(book_id, start_page, end_page,
-      user_info.user_id)
+      user_info.user_id, exclude_pages=True)
     
     if not content_sections:
       raise HTTPException(status_code=404, detail="No content sections of page range found")
     else:
+      lease_owner = str(uuid.uuid4())
       book_distilled_page = DistilledPage(
         book_id=book_id, user_id=user_info.user_id,
         start_page=start_page, end_page=end_page,
         paragraphs=[], created_datetime=datetime.now(timezone.utc),
-        processing_status=ProcessingStatus.IN_PROGRESS)  
-      book_distilled_page_repository.save(book_distilled_page)
-      message_broker.publish_job(ContentDistillProcessingJob(
-        book_id=book_id, start_page=start_page, end_page=end_page))
+        processing_status=ProcessingStatus.IN_PROGRESS,
+        priority=JobPriority.INTERACTIVE,
+        lease_owner=lease_owner,
+        lease_expiry=get_lease_expiry(settings.distill_queue_lease_seconds))
+      # Only the request creating the page queues its job, concurrent requests for the range wait on it
+      if book_distilled_page_repository.create_if_absent(book_distilled_page):
+        message_broker.publish_job(ContentDistillProcessingJob(
+          book_id=book_id, start_page=start_page, end_page=end_page,
+          priority=JobPriority.INTERACTIVE, lease_owner=lease_owner))
       return Response(status_code=status.HTTP_202_ACCEPTED, content="Processing started")
 
   else:
     if distilled_page.processing_status == ProcessingStatus.COMPLETED:
+      background_tasks.add_task(distill_prefetcher.prefetch, book_id, user_info.user_id, start_page)
+      return GetDistilledContentResponse(distilled_page=distilled_page)
+    # Opt-in, partial results must not end up in caches meant for completed content
+    elif allow_partial and distilled_page.processing_status == ProcessingStatus.PARTIAL:
+      background_tasks.add_task(distill_prefetcher.prefetch, book_id, user_info.user_id, start_page)
       return GetDistilledContentResponse(distilled_page=distilled_page)
     else:
+      # The reader caught up with a section only queued by prefetch, it is queued again ahead of background
+      # work. A page whose lease expired lost its job or worker, it is queued again as well
+      lease_owner = str(uuid.uuid4())
+      expected_owner = None
+      if (distilled_page.processing_status == ProcessingStatus.IN_PROGRESS and
+          distilled_page.priority == JobPriority.BACKGROUND):
+        expected_owner = distilled_page.lease_owner
+
+      if can_acquire_lease(distilled_page, lease_owner, expected_owner):
+        leased_page = book_distilled_page_repository.acquire_lease(
+          book_id, start_page, end_page, lease_owner, settings.distill_queue_lease_seconds,
+          expected_owner=expected_owner)
+        # Saved only while still leased, a worker may have taken the page over in between
+        if leased_page and book_distilled_page_repository.save_if_leased(
+            leased_page.model_copy(update={'priority': JobPriority.INTERACTIVE}), lease_owner):
+          message_broker.publish_job(ContentDistillProcessingJob(
+            book_id=book_id, start_page=start_page, end_page=end_page,
+            priority=JobPriority.INTERACTIVE, lease_owner=lease_owner))
       return Response(status_code=status.HTTP_202_ACCEPTED, content="Processing in progress")
\ No newline at end of file
@@ -5,15 +5,94 @@ load_dotenv()
 
 class Settings(BaseSettings):
   book_bucket_name: str = 'superreader-book-bucket'
+  book_page_store_prefix: str = 'pages'
 
   book_firestore_collection: str = 'BookInfo'
   book_content_section_firestore_collection: str = 'BookContentSection'
   book_distilled_page_firestore_collection: str = 'BookDistilledPage'
+  book_content_index_firestore_collection: str = 'BookContentIndex'
   
   post_upload_pubsub_topic: str = 'projects/superreader-442520/topics/post-upload-processing'
   post_upload_pubsub_subscription: str = 'projects/superreader-442520/subscriptions/post-upload-processing-sub'
   content_distill_pubsub_topic: str = 'projects/superreader-442520/topics/content-distill-processing'
   content_distill_pubsub_subscription: str = 'projects/superreader-442520/subscriptions/content-distill-processing-sub'
+  # Prefetch jobs, pulled after the jobs a reader is waiting for
+  content_distill_background_pubsub_topic: str = 'projects/superreader-442520/topics/content-distill-processing-background'
+  content_distill_background_pubsub_subscription: str = 'projects/superreader-442520/subscriptions/content-distill-processing-background-sub'
+  # A queued distill job not picked up within this time is presumed lost and queued again
+  distill_queue_lease_seconds: float = 900.0
+  # Lease of a worker running a distill job, renewed by heartbeats while it runs
+  distill_lease_seconds: float = 120.0
+  # Worker concurrency given to background jobs on top of the interactive ones, so they keep moving under load
+  distill_background_share: float = 0.2
+  # Distill jobs run at once by each worker
+  distill_worker_concurrency: int = 16
+
+  # Books processed at once by each post upload worker, shared fairly across users
+  post_upload_max_concurrency: int = 2
+  post_upload_max_in_flight_per_user: int = 1
+  # Jobs of a user waiting for a slot on a worker, further ones go back to the subscription for a while
+  post_upload_max_pending_per_user: int = 1
+  # Premium users get this many turns for every turn of a free user
+  post_upload_premium_weight: float = 2.0
+
+  # Each worker holds its own copy of the document, 0 uses every available core
+  pdf_loader_max_workers: int = 2
+  # Concurrent sectioning llm calls per book
+  content_section_max_concurrency: int = 8
+
+  # Sections over this many page tokens are split in chunks distilled concurrently
+  distill_page_token_budget: int = 12000
+  # Chunks of one section distilled at once, calls across sections and jobs are bounded by the rate limits
+  distill_max_concurrency: int = 16
+
+  # Sections distilled ahead of each reader, the depth follows the reader's pace within these bounds
+  distill_prefetch_min_depth: int = 1
+  distill_prefetch_max_depth: int = 4
+  # Sections of a reader queued or being distilled at once
+  distill_prefetch_max_in_flight: int = 6
+  # Typical time to distill one section, compared against the reader's seconds per section
+  distill_prefetch_distill_seconds: float = 90.0
+
+  # Distill requests slower than this percentile of recent latencies get a second, hedging request
+  llm_hedge_percentile: float = 0.95
+  # Model used by the hedging request, the same model when not listed
+  llm_hedge_fallback_models: dict[str, str] = {}
+  # Counted from when the call leaves the rate limit queue
+  llm_distill_timeout_seconds: float = 180.0
+
+  # Distilled paragraphs returned through a json schema instead of inline page markers
+  distill_structured_output: bool = False
+
+  llm_timeout_seconds: float = 120.0
+  llm_max_connections: int = 100
+  # Per process [requests per minute, tokens per minute] for each model
+  llm_rate_limits: dict[str, tuple[float, float]] = {
+    'gpt-4o': (5000, 800000),
+    'gpt-4o-mini': (5000, 4000000),
+  }
+
+  # Providers the llm router spreads calls over, any of openai and anthropic
+  llm_router_providers: list[str] = ['openai']
+  # Model requested by the agents to the anthropic model serving it
+  anthropic_models: dict[str, str] = {
+    'gpt-4o': 'claude-sonnet-4-5',
+    'gpt-4o-mini': 'claude-haiku-4-5',
+  }
+  anthropic_rate_limits: dict[str, tuple[float, float]] = {
+    'claude-sonnet-4-5': (4000, 2000000),
+    'claude-haiku-4-5': (4000, 4000000),
+  }
+
+  # sqlite (local to the worker), gcs (shared by every worker) or none
+  llm_cache_backend: str = 'sqlite'
+  llm_cache_sqlite_path: str = '/tmp/llm_response_cache.sqlite3'
+  llm_cache_prefix: str = 'llm-cache'
+  llm_cache_max_size_mb: int = 128
+
+  # openai (provider batch api) or local (runs the job in process through the llm client)
+  batch_job_backend: str = 'openai'
+  batch_job_poll_interval_seconds: float = 60.0
 
   gcp_service_account_path: str = ''
   gcp_service_account_json: str = ''
@@ -4,15 +4,36 @@ from dependency_injector import containers, providers
 from google.cloud.storage import Client, Bucket
 from firebase_admin import credentials
 from firebase_admin import firestore
-from google.cloud import pubsub_v1
+from google.cloud import monitoring_v3, pubsub_v1
 
 from api.settings import Settings
+from content_distill_processing.bulk_distill_service import BulkDistillService
+from content_distill_processing.prefetch_policy import DistillPrefetcher, ReaderPaceTracker
 from content_distill_processing.processing_service import ContentDistillProcessingJob, ContentDistillProcessingService
 from file_service.gcp import GcpFileService
+from llm_agent.batch_job_client.local import LocalBatchJobClient
+from llm_agent.batch_job_client.openai_client import OpenAiBatchJobClient
 from llm_agent.book_content_section_creater.content_section_creater import ContentSectionCreater
 from llm_agent.book_content_section_distill.content_section_distiller import ContentSectionDistiller
+from llm_agent.llm_cache.gcs import GcsLlmResponseCache
+from llm_agent.llm_cache.sqlite import SqliteLlmResponseCache
+from llm_agent.llm_client.anthropic_client import AnthropicLlmClient
+from llm_agent.llm_client.hedged import HedgedLlmClient
+from llm_agent.llm_client.openai_client import OpenAiLlmClient
+from llm_agent.llm_client.rate_limited import RateLimitedLlmClient
+from llm_agent.llm_client.router import LlmRoute, LlmRouter
+from llm_agent.page_encoder.delimited_encoder import DelimitedPageEncoder
+from llm_agent.rate_limit_scheduler import RateLimitScheduler
+from llm_agent.token_budget import TokenCounter
+from message_broker.priority_message_broker import JobPriority, PriorityMessageBroker
 from message_broker.pubsub_message_broker import MessageBroker
+from page_store.gcs import GcsPageStore
+from pdf_loader.page_normalizer import PageNormalizer
+from pdf_loader.pymupdf_loader import PymupdfLoader
+from post_upload_processing.content_section_pipeline import ContentSectionPipeline
+from post_upload_processing.outline_sectioner import OutlineSectioner
 from post_upload_processing.processing_service import PostProcessingJob, ProcessingService
+from repositories.book_content_index_repository.firebase import FirebaseBookContentIndexRepository
 from repositories.book_content_section_repository.firebase import FirebaseBookContentSectionRepository
 from repositories.book_distilled_page_repository.firebase import FirebaseBookDistilledPageRepository
 from repositories.book_repository.firebase import FirebaseBookRepository
@@ -25,12 +46,18 @@ settings = Settings()
 def create_none():
   return None
 
+def create_llm_routes(provider_names, **routes):
+  # Only the configured providers are instantiated
+  return [routes[name]() for name in provider_names]
+
 class Container(containers.DeclarativeContainer):
     wiring_config = containers.WiringConfiguration(modules=["api.routes.book", 
                                                             "api.routes.distilled_content"])
     config = providers.Configuration()
     config.from_dict(
-       {'gcp_service_account_loading_mode': settings.gcp_service_account_loading_mode}
+       {'gcp_service_account_loading_mode': settings.gcp_service_account_loading_mode,
+        'llm_cache_backend': settings.llm_cache_backend,
+        'batch_job_backend': settings.batch_job_backend}
     )
     
     storage_client = providers.Selector(
@@ -66,10 +93,29 @@ class Container(containers.DeclarativeContainer):
       collection_name=settings.book_firestore_collection
     )
 
+    page_store = providers.Singleton(
+      GcsPageStore,
+      bucket_name=settings.book_bucket_name,
+      prefix=settings.book_page_store_prefix
+    )
+
     book_content_section_repository = providers.Singleton(
       FirebaseBookContentSectionRepository,
       firebase_client=firestore_client,
-      collection_name=settings.book_content_section_firestore_collection
+      collection_name=settings.book_content_section_firestore_collection,
+      page_store=page_store
+    )
+
+    book_distilled_page_repository = providers.Singleton(
+      FirebaseBookDistilledPageRepository,
+      firebase_client=firestore_client,
+      collection_name=settings.book_distilled_page_firestore_collection
+    )
+
+    book_content_index_repository = providers.Singleton(
+      FirebaseBookContentIndexRepository,
+      firebase_client=firestore_client,
+      collection_name=settings.book_content_index_firestore_collection
     )
 
     pubsub_publisher = providers.Singleton(
@@ -80,6 +126,10 @@ class Container(containers.DeclarativeContainer):
       pubsub_v1.SubscriberClient,
     )
 
+    pubsub_metric_client = providers.Singleton(
+      monitoring_v3.MetricServiceClient,
+    )
+
     post_upload_message_broker = providers.Singleton(
       MessageBroker,
       pubsub_topic=settings.post_upload_pubsub_topic,
@@ -89,39 +139,185 @@ class Container(containers.DeclarativeContainer):
       model_type=PostProcessingJob
     )
 
+    token_counter = providers.Singleton(
+      TokenCounter
+    )
+
+    llm_response_cache = providers.Selector(
+      config.llm_cache_backend,
+      sqlite=providers.Singleton(
+        SqliteLlmResponseCache,
+        path=settings.llm_cache_sqlite_path,
+        max_size_bytes=settings.llm_cache_max_size_mb * 1024 * 1024),
+      gcs=providers.Singleton(
+        GcsLlmResponseCache,
+        bucket_name=settings.book_bucket_name,
+        max_size_bytes=settings.llm_cache_max_size_mb * 1024 * 1024,
+        prefix=settings.llm_cache_prefix),
+      none=providers.Singleton(create_none)
+    )
+
+    openai_llm_client = providers.Singleton(
+      OpenAiLlmClient,
+      api_key=settings.open_ai_api_key,
+      timeout=settings.llm_timeout_seconds,
+      max_connections=settings.llm_max_connections
+    )
+
+    llm_rate_limit_scheduler = providers.Singleton(
+      RateLimitScheduler,
+      model_rate_limits=settings.llm_rate_limits
+    )
+
+    openai_llm_route = providers.Singleton(
+      LlmRoute,
+      name='openai',
+      llm_client=providers.Singleton(
+        RateLimitedLlmClient,
+        llm_client=openai_llm_client,
+        scheduler=llm_rate_limit_scheduler,
+        token_counter=token_counter),
+      scheduler=llm_rate_limit_scheduler
+    )
+
+    anthropic_rate_limit_scheduler = providers.Singleton(
+      RateLimitScheduler,
+      model_rate_limits=settings.anthropic_rate_limits
+    )
+
+    anthropic_llm_route = providers.Singleton(
+      LlmRoute,
+      name='anthropic',
+      llm_client=providers.Singleton(
+        RateLimitedLlmClient,
+        llm_client=providers.Singleton(
+          AnthropicLlmClient,
+          api_key=settings.claude_api_key,
+          timeout=settings.llm_timeout_seconds),
+        scheduler=anthropic_rate_limit_scheduler,
+        token_counter=token_counter),
+      scheduler=anthropic_rate_limit_scheduler,
+      models=settings.anthropic_models
+    )
+
+    llm_client = providers.Singleton(
+      LlmRouter,
+      routes=providers.Callable(
+        create_llm_routes,
+        settings.llm_router_providers,
+        openai=openai_llm_route.provider,
+        anthropic=anthropic_llm_route.provider)
+    )
+
+    page_encoder = providers.Singleton(
+      DelimitedPageEncoder
+    )
+
     content_section_creater = providers.Singleton(
       ContentSectionCreater,
-      openai_api_key=settings.open_ai_api_key
+      llm_client=llm_client,
+      token_counter=token_counter,
+      response_cache=llm_response_cache,
+      page_encoder=page_encoder
     )
     
+    pdf_loader = providers.Singleton(
+      PymupdfLoader,
+      max_workers=settings.pdf_loader_max_workers or None
+    )
+
+    page_normalizer = providers.Singleton(
+      PageNormalizer,
+      token_counter=token_counter
+    )
+
+    content_section_pipeline = providers.Singleton(
+      ContentSectionPipeline,
+      content_section_creater=content_section_creater,
+      max_concurrency=settings.content_section_max_concurrency
+    )
+
+    outline_sectioner = providers.Singleton(
+      OutlineSectioner
+    )
+
     content_section_processing_service = providers.Singleton(
       ProcessingService,
       message_broker=post_upload_message_broker,
       file_service=file_service,
       book_repository=book_repository,
       book_content_section_repository=book_content_section_repository,
-      content_section_creater=content_section_creater
+      book_distilled_page_repository=book_distilled_page_repository,
+      book_content_index_repository=book_content_index_repository,
+      content_section_pipeline=content_section_pipeline,
+      outline_sectioner=outline_sectioner,
+      pdf_loader=pdf_loader,
+      page_normalizer=page_normalizer,
+      page_store=page_store,
+      max_concurrency=settings.post_upload_max_concurrency,
+      max_in_flight_per_user=settings.post_upload_max_in_flight_per_user,
+      max_pending_per_user=settings.post_upload_max_pending_per_user,
+      premium_weight=settings.post_upload_premium_weight
+    )
+
+    distill_llm_client = providers.Singleton(
+      HedgedLlmClient,
+      llm_client=llm_client,
+      token_counter=token_counter,
+      fallback_models=settings.llm_hedge_fallback_models,
+      hedge_percentile=settings.llm_hedge_percentile,
+      timeout_seconds=settings.llm_distill_timeout_seconds,
+      max_workers=settings.llm_max_connections
     )
 
     content_section_distiller = providers.Singleton(
       ContentSectionDistiller,
-      openai_api_key=settings.open_ai_api_key,
-      model='gpt-4o'
+      llm_client=distill_llm_client,
+      token_counter=token_counter,
+      model='gpt-4o',
+      page_token_budget=settings.distill_page_token_budget,
+      max_concurrency=settings.distill_max_concurrency,
+      response_cache=llm_response_cache,
+      page_encoder=page_encoder,
+      structured_output=settings.distill_structured_output
     )
     
-    book_distilled_page_repository = providers.Singleton(
-      FirebaseBookDistilledPageRepository,
-      firebase_client=firestore_client,
-      collection_name=settings.book_distilled_page_firestore_collection
+    content_distill_message_broker = providers.Singleton(
+      PriorityMessageBroker,
+      message_brokers=providers.Dict({
+        JobPriority.INTERACTIVE: providers.Singleton(
+          MessageBroker,
+          pubsub_topic=settings.content_distill_pubsub_topic,
+          pubsub_subscription=settings.content_distill_pubsub_subscription,
+          pubsub_publisher=pubsub_publisher,
+          pubsub_subscriptor=pubsub_subscriptor,
+          model_type=ContentDistillProcessingJob,
+          metric_client=pubsub_metric_client
+        ),
+        JobPriority.BACKGROUND: providers.Singleton(
+          MessageBroker,
+          pubsub_topic=settings.content_distill_background_pubsub_topic,
+          pubsub_subscription=settings.content_distill_background_pubsub_subscription,
+          pubsub_publisher=pubsub_publisher,
+          pubsub_subscriptor=pubsub_subscriptor,
+          model_type=ContentDistillProcessingJob,
+          metric_client=pubsub_metric_client
+        ),
+      }),
+      low_priority_shares={JobPriority.BACKGROUND: settings.distill_background_share}
     )
 
-    content_distill_message_broker = providers.Singleton(
-      MessageBroker,
-      pubsub_topic=settings.content_distill_pubsub_topic,
-      pubsub_subscription=settings.content_distill_pubsub_subscription,
-      pubsub_publisher=pubsub_publisher,
-      pubsub_subscriptor=pubsub_subscriptor,
-      model_type=ContentDistillProcessingJob
+    distill_prefetcher = providers.Singleton(
+      DistillPrefetcher,
+      message_broker=content_distill_message_broker,
+      book_content_section_repository=book_content_section_repository,
+      book_distilled_page_repository=book_distilled_page_repository,
+      pace_tracker=providers.Singleton(ReaderPaceTracker),
+      min_depth=settings.distill_prefetch_min_depth,
+      max_depth=settings.distill_prefetch_max_depth,
+      max_in_flight=settings.distill_prefetch_max_in_flight,
+      distill_seconds_estimate=settings.distill_prefetch_distill_seconds,
+      in_flight_expiry_seconds=settings.distill_queue_lease_seconds
     )
 
     content_distill_processing_service = providers.Singleton(
@@ -129,7 +325,28 @@ class Container(containers.DeclarativeContainer):
         message_broker=content_distill_message_broker,
         book_content_section_repository=book_content_section_repository,
         book_distilled_page_repository=book_distilled_page_repository,
-        content_section_distiller=content_section_distiller
+        content_section_distiller=content_section_distiller,
+        lease_seconds=settings.distill_lease_seconds,
+        max_concurrency=settings.distill_worker_concurrency
+    )
+
+    batch_job_client = providers.Selector(
+      config.batch_job_backend,
+      openai=providers.Singleton(
+        OpenAiBatchJobClient,
+        api_key=settings.open_ai_api_key),
+      local=providers.Singleton(
+        LocalBatchJobClient,
+        llm_client=llm_client)
+    )
+
+    bulk_distill_service = providers.Singleton(
+      BulkDistillService,
+      book_content_section_repository=book_content_section_repository,
+      book_distilled_page_repository=book_distilled_page_repository,
+      content_section_distiller=content_section_distiller,
+      batch_job_client=batch_job_client,
+      poll_interval_seconds=settings.batch_job_poll_interval_seconds
     )
 
     # token_decoder = FirestoreTokenDecoder(
@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+import logging
+import time
+
+from typing import Dict, List, Optional, Set, Tuple
+
+from llm_agent.batch_job_client.base import BatchJobClient, BatchJobRequest, BatchJobStatus
+from llm_agent.book_content_section_distill.content_section_distiller import ContentSectionDistiller
+from repositories.book_content_section_repository.base import BookContentSection, BookContentSectionRepository
+from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus
+
+
+class BulkDistillService:
+  """
+  Backfills the distilled pages of whole books through one batch job instead of interactive calls,
+  cheaper per page and leaves the interactive rate limits to readers.
+  """
+  def __init__(self, book_content_section_repository: BookContentSectionRepository,
+               book_distilled_page_repository: BookDistilledPageRepository,
+               content_section_distiller: ContentSectionDistiller,
+               batch_job_client: BatchJobClient,
+               poll_interval_seconds: float = 60.0) -> None:
+    self._book_content_section_repository = book_content_section_repository
+    self._book_distilled_page_repository = book_distilled_page_repository
+    self._content_section_distiller = content_section_distiller
+    self._batch_job_client = batch_job_client
+    self._poll_interval_seconds = poll_interval_seconds
+
+
+  def distill_books(self, book_ids: List[str]) -> int:
+    """
+    Returns the number of distilled pages saved.
+    """
+    sections: Dict[str, BookContentSection] = {}
+    requests = []
+    # Ranges with a record already, interactive requests may have left unfinished ones
+    existing_ranges: Set[Tuple[str, int, int]] = set()
+    for book_id in book_ids:
+      undistilled_sections, book_existing_ranges = self._get_undistilled_sections(book_id)
+      existing_ranges.update(book_existing_ranges)
+      for content_section in undistilled_sections:
+        section_id = f'{book_id}:{content_section.start_page}:{content_section.end_page}'
+        sections[section_id] = content_section
+        for pack_index, pages in enumerate(self._content_section_distiller.pack_pages(content_section.pages)):
+          requests.append(BatchJobRequest(
+            custom_id=f'{section_id}:{pack_index}',
+            request=self._content_section_distiller.build_request(pages)))
+
+    if not requests:
+      logging.info(f"Nothing to distill for books {book_ids}")
+      return 0
+
+    job_id = self._batch_job_client.submit(requests)
+    logging.info(f"Submitted batch job {job_id} with {len(requests)} requests for {len(sections)} sections")
+    status = self._wait_for_job(job_id)
+    if status == BatchJobStatus.FAILED:
+      logging.error(f"Batch job {job_id} failed")
+      return 0
+
+    return self._save_results(job_id, sections, requests, existing_ranges)
+
+
+  def _get_undistilled_sections(self, book_id: str) -> Tuple[List[BookContentSection], Set[Tuple[str, int, int]]]:
+    """
+    Returns the sections without a completed distilled page, and the ranges of the book with a record.
+    """
+    distilled_pages = self._book_distilled_page_repository.get_all(book_id)
+    completed_ranges = {(p.start_page, p.end_page) for p in distilled_pages
+                        if p.processing_status == ProcessingStatus.COMPLETED}
+    existing_ranges = {(book_id, p.start_page, p.end_page) for p in distilled_pages}
+    return [s for s in self._book_content_section_repository.get_all(book_id)
+            if s.pages and (s.start_page, s.end_page) not in completed_ranges], existing_ranges
+
+
+  def _wait_for_job(self, job_id: str) -> BatchJobStatus:
+    while True:
+      status = self._batch_job_client.get_status(job_id)
+      if status.is_terminal:
+        return status
+      time.sleep(self._poll_interval_seconds)
+
+
+  def _save_results(self, job_id: str, sections: Dict[str, BookContentSection],
+                    requests: List[BatchJobRequest], existing_ranges: Set[Tuple[str, int, int]]) -> int:
+    contents: Dict[str, Optional[str]] = {}
+    for result in self._batch_job_client.get_results(job_id):
+      if result.error:
+        logging.warning(f"Batch request {result.custom_id} failed: {result.error}")
+      contents[result.custom_id] = result.content
+
+    pack_ids: Dict[str, List[str]] = {}
+    for request in requests:
+      pack_ids.setdefault(request.custom_id.rsplit(':', 1)[0], []).append(request.custom_id)
+
+    distilled_pages = []
+    for section_id, content_section in sections.items():
+      # Sections missing any pack are left to the interactive path
+      pack_contents = [contents.get(pack_id) for pack_id in pack_ids[section_id]]
+      if any(content is None for content in pack_contents):
+        continue
+
+      try:
+        paragraphs = self._content_section_distiller.stitch_chunks(
+          [self._content_section_distiller.parse_response(content) for content in pack_contents])
+      except Exception:
+        logging.exception(f"Could not parse batch results of section {section_id}")
+        continue
+
+      distilled_pages.append(DistilledPage(
+        book_id=content_section.book_id,
+        user_id=content_section.user_id,
+        start_page=content_section.start_page,
+        end_page=content_section.end_page,
+        paragraphs=self._content_section_distiller.merge_paragraphs(paragraphs),
+        created_datetime=datetime.now(timezone.utc),
+        processing_status=ProcessingStatus.COMPLETED))
+
+    # Records left by interactive requests are updated in place, save_multiple only creates.
+    # New records are written per book, so a failed write only loses the results of one book
+    new_distilled_pages_by_book: Dict[str, List[DistilledPage]] = {}
+    for distilled_page in distilled_pages:
+      if (distilled_page.book_id, distilled_page.start_page, distilled_page.end_page) in existing_ranges:
+        self._book_distilled_page_repository.save(distilled_page)
+      else:
+        new_distilled_pages_by_book.setdefault(distilled_page.book_id, []).append(distilled_page)
+    for new_distilled_pages in new_distilled_pages_by_book.values():
+      self._book_distilled_page_repository.save_multiple(new_distilled_pages)
+    logging.info(f"Batch job {job_id} distilled {len(distilled_pages)} of {len(sections)} sections")
+    return len(distilled_pages)
@@ -0,0 +1,20 @@
+import logging
+import sys
+
+from backend.container.prod import Container
+from dependency_injector.wiring import Provide, inject
+
+from backend.content_distill_processing.bulk_distill_service import BulkDistillService
+
+@inject
+def main(book_ids: list[str], bulk_distill_service: BulkDistillService = Provide[Container.bulk_distill_service]) -> None:
+  bulk_distill_service.distill_books(book_ids)
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+
+  container = Container()
+  container.init_resources()
+  container.wire(modules=[__name__])
+
+  main(sys.argv[1:])
@@ -0,0 +1,175 @@
+from datetime import datetime, timezone
+import logging
+import math
+import threading
+import time
+import uuid
+
+from typing import Dict, Optional, Tuple
+
+from content_distill_processing.processing_service import ContentDistillProcessingJob
+from message_broker.priority_message_broker import JobPriority, PriorityMessageBroker
+from repositories.book_content_section_repository.base import BookContentSection, BookContentSectionRepository
+from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus, get_lease_expiry
+
+
+class _ReaderPace:
+  def __init__(self, section_index: int, observed_at: float) -> None:
+    self.section_index = section_index
+    self.observed_at = observed_at
+    self.seconds_per_section: Optional[float] = None
+
+
+class ReaderPaceTracker:
+  """
+  Smoothed seconds each reader spends per section of a book, from the positions they look up.
+  Kept in memory, every api instance learns the pace of the readers it serves.
+  """
+  def __init__(self, smoothing: float = 0.3, max_section_jump: int = 3, max_reader_count: int = 100000) -> None:
+    self._smoothing = smoothing
+    # Larger jumps are the reader skipping ahead, not reading
+    self._max_section_jump = max_section_jump
+    self._max_reader_count = max_reader_count
+    self._paces: Dict[Tuple[str, str], _ReaderPace] = {}
+    self._lock = threading.Lock()
+
+
+  def observe(self, user_id: str, book_id: str, section_index: int) -> Optional[float]:
+    """
+    Returns the reader's seconds per section, None until it is known.
+    """
+    now = time.monotonic()
+    key = (user_id, book_id)
+    with self._lock:
+      pace = self._paces.get(key)
+      if pace is None:
+        if len(self._paces) >= self._max_reader_count:
+          self._paces.pop(next(iter(self._paces)))
+        self._paces[key] = _ReaderPace(section_index, now)
+        return None
+
+      section_jump = section_index - pace.section_index
+      if 0 < section_jump <= self._max_section_jump:
+        sample = (now - pace.observed_at) / section_jump
+        if pace.seconds_per_section is None:
+          pace.seconds_per_section = sample
+        else:
+          pace.seconds_per_section += self._smoothing * (sample - pace.seconds_per_section)
+      if section_jump != 0:
+        pace.section_index = section_index
+        pace.observed_at = now
+      return pace.seconds_per_section
+
+
+class DistillPrefetcher:
+  """
+  Queues the distillation of the sections ahead of a reader so they are completed before the reader
+  gets there. The depth covers the expected distill time at the reader's pace, sections that already
+  have a distilled page are skipped, and a reader never has more than max_in_flight sections pending
+  across all of their books. A book is looked at again at most every min_interval_seconds per reader.
+  """
+  def __init__(self, message_broker: PriorityMessageBroker,
+               book_content_section_repository: BookContentSectionRepository,
+               book_distilled_page_repository: BookDistilledPageRepository,
+               pace_tracker: ReaderPaceTracker,
+               min_depth: int = 1, max_depth: int = 4, max_in_flight: int = 6,
+               distill_seconds_estimate: float = 90.0, in_flight_expiry_seconds: float = 900.0,
+               min_interval_seconds: float = 10.0, max_reader_count: int = 100000) -> None:
+    self._message_broker = message_broker
+    self._book_content_section_repository = book_content_section_repository
+    self._book_distilled_page_repository = book_distilled_page_repository
+    self._pace_tracker = pace_tracker
+    self._min_depth = min_depth
+    self._max_depth = max_depth
+    self._max_in_flight = max_in_flight
+    self._distill_seconds_estimate = distill_seconds_estimate
+    # Older unfinished records are abandoned jobs and no longer count against the cap
+    self._in_flight_expiry_seconds = in_flight_expiry_seconds
+    self._min_interval_seconds = min_interval_seconds
+    self._max_reader_count = max_reader_count
+    self._last_prefetch_times: Dict[Tuple[str, str], float] = {}
+    self._lock = threading.Lock()
+
+
+  def prefetch(self, book_id: str, user_id: str, page_num: int) -> int:
+    """
+    Returns the number of distill jobs queued. Meant to run as a background task, after the
+    response to the reader is sent.
+    """
+    if not self._start_prefetch(user_id, book_id):
+      return 0
+
+    content_sections = sorted(
+      self._book_content_section_repository.get_all(book_id, user_id, exclude_pages=True),
+      key=lambda s: s.start_page)
+    section_index = next((index for index, s in enumerate(content_sections)
+                          if s.start_page <= page_num <= s.end_page), None)
+    if section_index is None:
+      return 0
+
+    seconds_per_section = self._pace_tracker.observe(user_id, book_id, section_index)
+    depth = self._get_depth(seconds_per_section)
+
+    existing_ranges = {(p.start_page, p.end_page)
+                       for p in self._book_distilled_page_repository.get_all(book_id, user_id)}
+    # Counted from the records, so the cap holds across books and api instances
+    now = datetime.now(timezone.utc)
+    in_flight_count = sum(1 for p in self._book_distilled_page_repository.get_unfinished_by_user(user_id)
+                          if (now - p.created_datetime).total_seconds() < self._in_flight_expiry_seconds)
+
+    queued_count = 0
+    for content_section in content_sections[section_index + 1:section_index + 1 + depth]:
+      if in_flight_count >= self._max_in_flight:
+        break
+      if (content_section.start_page, content_section.end_page) in existing_ranges:
+        continue
+
+      if not self._queue(book_id, user_id, content_section):
+        continue
+      in_flight_count += 1
+      queued_count += 1
+
+    if queued_count:
+      logging.info(f"Prefetching {queued_count} sections of book {book_id} for user {user_id}, "
+                   f"depth {depth}, seconds per section {seconds_per_section}")
+    return queued_count
+
+
+  def _start_prefetch(self, user_id: str, book_id: str) -> bool:
+    now = time.monotonic()
+    key = (user_id, book_id)
+    with self._lock:
+      if now - self._last_prefetch_times.get(key, -self._min_interval_seconds) < self._min_interval_seconds:
+        return False
+      self._last_prefetch_times.pop(key, None)
+      if len(self._last_prefetch_times) >= self._max_reader_count:
+        self._last_prefetch_times.pop(next(iter(self._last_prefetch_times)))
+      self._last_prefetch_times[key] = now
+      return True
+
+
+  def _get_depth(self, seconds_per_section: Optional[float]) -> int:
+    if not seconds_per_section:
+      return self._min_depth
+    # Sections the reader gets through while one is distilled, plus the one being read
+    depth = math.ceil(self._distill_seconds_estimate / seconds_per_section) + 1
+    return max(self._min_depth, min(self._max_depth, depth))
+
+
+  def _queue(self, book_id: str, user_id: str, content_section: BookContentSection) -> bool:
+    lease_owner = str(uuid.uuid4())
+    # Lost when a reader or another api instance queued the section first
+    if not self._book_distilled_page_repository.create_if_absent(DistilledPage(
+        book_id=book_id, user_id=user_id,
+        start_page=content_section.start_page, end_page=content_section.end_page,
+        paragraphs=[], created_datetime=datetime.now(timezone.utc),
+        processing_status=ProcessingStatus.IN_PROGRESS,
+        priority=JobPriority.BACKGROUND,
+        lease_owner=lease_owner,
+        lease_expiry=get_lease_expiry(self._in_flight_expiry_seconds))):
+      return False
+
+    self._message_broker.publish_job(ContentDistillProcessingJob(
+      book_id=book_id, start_page=content_section.start_page, end_page=content_section.end_page,
+      priority=JobPriority.BACKGROUND, lease_owner=lease_owner))
+    return True
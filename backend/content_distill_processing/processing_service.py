@@ -1,41 +1,69 @@
 
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import logging
+import threading
+import time
+import uuid
+from typing import Iterator, Optional
 from pydantic import BaseModel
 
 
 from llm_agent.book_content_section_distill.content_section_distiller import ContentSectionDistiller
-from message_broker.pubsub_message_broker import MessageBroker
+from message_broker.priority_message_broker import JobPriority, PriorityMessageBroker
 from repositories.book_content_section_repository.base import BookContentSection, BookContentSectionRepository, Page
-from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus
+from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, DistilledPageParagraph, LeaseLostError, ProcessingStatus, get_lease_expiry
 
 
 class ContentDistillProcessingJob(BaseModel):
   book_id: str
   start_page: int
   end_page: int
+  priority: JobPriority = JobPriority.INTERACTIVE
+  # Lease taken by the publisher, the worker takes it over from this owner
+  lease_owner: Optional[str] = None
 
 
 class ContentDistillProcessingService:
-  def __init__(self, message_broker: MessageBroker,  
+  def __init__(self, message_broker: PriorityMessageBroker,
                book_content_section_repository: BookContentSectionRepository,
                book_distilled_page_repository: BookDistilledPageRepository,
-               content_section_distiller: ContentSectionDistiller) -> None:
+               content_section_distiller: ContentSectionDistiller,
+               partial_save_interval_seconds: float = 1.0,
+               queue_depth_log_interval_seconds: float = 60.0,
+               lease_seconds: float = 120.0,
+               max_concurrency: int = 16) -> None:
     self._message_broker = message_broker
     self._book_content_section_repository = book_content_section_repository
     self._book_distilled_page_repository = book_distilled_page_repository
     self._content_section_distiller = content_section_distiller
+    self._partial_save_interval_seconds = partial_save_interval_seconds
+    self._queue_depth_log_interval_seconds = queue_depth_log_interval_seconds
+    # Heartbeats renew the lease well before it expires, an expired lease means the worker died
+    self._lease_seconds = lease_seconds
+    # Jobs run at once by the worker, each keeps up to the distiller's own concurrency of llm calls in flight
+    self._max_concurrency = max_concurrency
 
   def start(self) -> None:
-    while True:
-      job = self._message_broker.get_next_job()
-      if job is None:
-        logging.info("No job to process")
-        continue
+    futures = self._message_broker.subscribe(self._handle_job, self._max_concurrency)
+    try:
+      while True:
+        logging.info(f"Queue depth per priority: {self._message_broker.get_queue_depths()}")
+        # Returns early only when a subscription stopped, its error is raised by result
+        done_futures, _ = wait(futures, timeout=self._queue_depth_log_interval_seconds,
+                               return_when=FIRST_COMPLETED)
+        for future in done_futures:
+          future.result()
+    finally:
+      for future in futures:
+        future.cancel()
 
-      logging.info(f"Processing job: {job.model_dump_json()}")
-      self._process_job(job)
-      logging.info(f"Job processed: {job.model_dump_json()}")
+
+  def _handle_job(self, job: ContentDistillProcessingJob) -> None:
+    logging.info(f"Processing job: {job.model_dump_json()}")
+    self._process_job(job)
+    logging.info(f"Job processed: {job.model_dump_json()}")
 
 
   def _process_job(self, job: ContentDistillProcessingJob) -> None:
@@ -48,34 +76,97 @@ class ContentDistillProcessingService:
     if distilled_page and distilled_page.processing_status == ProcessingStatus.COMPLETED:
       return
     
-    if not distilled_page:  
-      distilled_page = DistilledPage(
+    if not distilled_page:
+      self._book_distilled_page_repository.create_if_absent(DistilledPage(
         book_id=job.book_id,
         user_id=content_section.user_id,
         start_page=job.start_page,
         end_page=job.end_page,
         paragraphs=[],
         created_datetime=datetime.now(timezone.utc),
-        processing_status=ProcessingStatus.IN_PROGRESS)
-    else:
-      distilled_page = DistilledPage(
+        processing_status=ProcessingStatus.IN_PROGRESS))
+
+    # Duplicate jobs of the same range lose here, instead of running the same llm calls again
+    lease_owner = str(uuid.uuid4())
+    leased_page = self._book_distilled_page_repository.acquire_lease(
+      job.book_id, job.start_page, job.end_page, lease_owner, self._lease_seconds,
+      expected_owner=job.lease_owner)
+    if leased_page is None:
+      logging.info(f"Distilled page is completed or leased by another job, skipping: {job.model_dump_json()}")
+      return
+
+    distilled_page = leased_page.model_copy(update={
+      'paragraphs': [],
+      'processing_status': ProcessingStatus.IN_PROGRESS,
+      'priority': None})
+    try:
+      # Every write checks the lease, a worker that lost it stops instead of overwriting the new owner
+      self._save_leased(distilled_page, lease_owner)
+
+      # Paragraphs are saved as they stream in, throttled to bound the number of writes
+      last_save_time = time.monotonic()
+      def save_partial(paragraphs: list[DistilledPageParagraph]) -> None:
+        nonlocal last_save_time
+        if lease_lost.is_set():
+          raise LeaseLostError(f"Lost the lease of job: {job.model_dump_json()}")
+        if time.monotonic() - last_save_time < self._partial_save_interval_seconds:
+          return
+        last_save_time = time.monotonic()
+        self._save_leased(distilled_page.model_copy(update={
+          'paragraphs': paragraphs,
+          'processing_status': ProcessingStatus.PARTIAL,
+          'lease_expiry': get_lease_expiry(self._lease_seconds)}), lease_owner)
+
+      with self._hold_lease(job, lease_owner) as lease_lost:
+        start_page, end_page, paragraphs = self._content_section_distiller.stream_summarize_content(
+          content_section.pages, save_partial,
+          background=job.priority == JobPriority.BACKGROUND)
+
+      self._save_leased(DistilledPage(
         book_id=distilled_page.book_id,
         user_id=distilled_page.user_id,
-        start_page=distilled_page.start_page,
-        end_page=distilled_page.end_page,
-        paragraphs=[],
+        start_page=start_page,
+        end_page=end_page,
+        paragraphs=paragraphs,
         created_datetime=distilled_page.created_datetime,
-        processing_status=ProcessingStatus.IN_PROGRESS)
-    
-    self._book_distilled_page_repository.save(distilled_page)
-    start_page, end_page, paragraphs = self._content_section_distiller.summarize_content(content_section.pages)
-    distilled_page = DistilledPage(
-      book_id=distilled_page.book_id,
-      user_id=distilled_page.user_id,
-      start_page=start_page,
-      end_page=end_page,
-      paragraphs=paragraphs,
-      created_datetime=distilled_page.created_datetime,
-      processing_status=ProcessingStatus.COMPLETED)
-    
-    self._book_distilled_page_repository.save(distilled_page)
+        processing_status=ProcessingStatus.COMPLETED), lease_owner)
+    except LeaseLostError:
+      # The new owner distills the page, nothing to retry
+      logging.warning(f"Stopped job after losing its lease: {job.model_dump_json()}")
+    except Exception:
+      # Handed back to the job, so its redelivery takes the page over without waiting for the lease to expire
+      if job.lease_owner:
+        self._book_distilled_page_repository.acquire_lease(
+          job.book_id, job.start_page, job.end_page, job.lease_owner, self._lease_seconds,
+          expected_owner=lease_owner)
+      raise
+
+
+  def _save_leased(self, distilled_page: DistilledPage, lease_owner: str) -> None:
+    if not self._book_distilled_page_repository.save_if_leased(distilled_page, lease_owner):
+      raise LeaseLostError(f"Lost the lease of distilled page: {distilled_page.book_id} "
+                           f"{distilled_page.start_page}-{distilled_page.end_page}")
+
+
+  @contextmanager
+  def _hold_lease(self, job: ContentDistillProcessingJob, lease_owner: str) -> Iterator[threading.Event]:
+    """
+    Renews the lease while the block runs, yields an event set once the lease is lost.
+    """
+    stopped = threading.Event()
+    lease_lost = threading.Event()
+    def heartbeat() -> None:
+      while not stopped.wait(self._lease_seconds / 3):
+        if self._book_distilled_page_repository.acquire_lease(
+            job.book_id, job.start_page, job.end_page, lease_owner, self._lease_seconds) is None:
+          logging.warning(f"Lost the lease of job: {job.model_dump_json()}")
+          lease_lost.set()
+          return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+      yield lease_lost
+    finally:
+      stopped.set()
+      heartbeat_thread.join()
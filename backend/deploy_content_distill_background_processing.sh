@@ -0,0 +1,9 @@
+gcloud functions deploy content_distill_background_service \
+    --runtime python39 \
+    --trigger-topic content-distill-processing-background \
+    --entry-point process_content_distill_background \
+    --retry \
+    --memory 256MB \
+    --timeout 540s \
+    --max-instances 5 \
+    --service-account=content-distill@superreader-442520.iam.gserviceaccount.com
\ No newline at end of file
@@ -13,3 +13,6 @@ class FileService(ABC):
 
   def download_to_destination(self, file_name: str, destination_path: str) -> str:
     pass
+
+  def download_as_bytes(self, file_name: str) -> bytes:
+    pass
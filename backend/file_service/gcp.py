@@ -7,11 +7,13 @@ import google.cloud.storage as storage
 
 
 class GcpFileService(FileService):
-  def __init__(self, bucket_name: str, service_account_email: str) -> None:
+  def __init__(self, bucket_name: str, service_account_email: str,
+               download_chunk_size: int = 8 * 1024 * 1024) -> None:
     self._client = storage.Client()
     self._bucket_name = bucket_name
     self._bucket = self._client.bucket(bucket_name)
     self._service_account_email = service_account_email
+    self._download_chunk_size = download_chunk_size
 
 
   def get_upload_url(self, file_name: str) -> str:
@@ -51,4 +53,9 @@ class GcpFileService(FileService):
 
   def download_to_destination(self, file_name: str, destination_path: str) -> str:
     blob = self._bucket.blob(file_name)
-    blob.download_to_filename(destination_path)
\ No newline at end of file
+    blob.download_to_filename(destination_path)
+
+  def download_as_bytes(self, file_name: str) -> bytes:
+    # Downloaded in chunks straight into memory, nothing touches the local disk
+    blob = self._bucket.blob(file_name, chunk_size=self._download_chunk_size)
+    return blob.download_as_bytes()
@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import List, Optional
+from pydantic import BaseModel
+
+from llm_agent.llm_client.base import LlmRequest
+
+
+class BatchJobStatus(str, Enum):
+  IN_PROGRESS = "IN_PROGRESS"
+  COMPLETED = "COMPLETED"
+  FAILED = "FAILED"
+
+  @property
+  def is_terminal(self) -> bool:
+    return self != BatchJobStatus.IN_PROGRESS
+
+
+class BatchJobRequest(BaseModel):
+  # Unique within a job, used to match results back to requests
+  custom_id: str
+  request: LlmRequest
+
+
+class BatchJobResult(BaseModel):
+  custom_id: str
+  content: Optional[str] = None
+  error: Optional[str] = None
+
+
+class BatchJobClient(ABC):
+  """
+  Completion jobs run offline by the provider, cheaper than interactive calls but only finished
+  within the provider's completion window.
+  """
+  @abstractmethod
+  def submit(self, requests: List[BatchJobRequest]) -> str:
+    """
+    Returns the id of the submitted job.
+    """
+    pass
+
+  @abstractmethod
+  def get_status(self, job_id: str) -> BatchJobStatus:
+    pass
+
+  @abstractmethod
+  def get_results(self, job_id: str) -> List[BatchJobResult]:
+    pass
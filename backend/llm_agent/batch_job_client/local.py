@@ -0,0 +1,48 @@
+import threading
+import uuid
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+from llm_agent.batch_job_client.base import BatchJobClient, BatchJobRequest, BatchJobResult, BatchJobStatus
+from llm_agent.llm_client.base import LlmClient
+
+
+class LocalBatchJobClient(BatchJobClient):
+  """
+  Stand-in for a provider batch endpoint, runs the job in process through a regular LlmClient.
+  """
+  def __init__(self, llm_client: LlmClient, max_concurrency: int = 4) -> None:
+    self._llm_client = llm_client
+    self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    self._jobs: Dict[str, List[Future]] = {}
+    self._lock = threading.Lock()
+
+
+  def submit(self, requests: List[BatchJobRequest]) -> str:
+    job_id = f'local-batch-{uuid.uuid4().hex}'
+    futures = [self._executor.submit(self._run_request, request) for request in requests]
+    with self._lock:
+      self._jobs[job_id] = futures
+    return job_id
+
+
+  def get_status(self, job_id: str) -> BatchJobStatus:
+    with self._lock:
+      futures = self._jobs[job_id]
+    if all(future.done() for future in futures):
+      return BatchJobStatus.COMPLETED
+    return BatchJobStatus.IN_PROGRESS
+
+
+  def get_results(self, job_id: str) -> List[BatchJobResult]:
+    with self._lock:
+      futures = self._jobs[job_id]
+    return [future.result() for future in futures if future.done()]
+
+
+  def _run_request(self, request: BatchJobRequest) -> BatchJobResult:
+    try:
+      return BatchJobResult(custom_id=request.custom_id, content=self._llm_client.complete(request.request))
+    except Exception as e:
+      return BatchJobResult(custom_id=request.custom_id, error=str(e))
@@ -0,0 +1,66 @@
+import json
+
+from typing import List
+from openai import OpenAI
+
+from llm_agent.batch_job_client.base import BatchJobClient, BatchJobRequest, BatchJobResult, BatchJobStatus
+from llm_agent.llm_client.openai_client import to_chat_completion_arguments
+
+_TERMINAL_STATUSES = {
+  'completed': BatchJobStatus.COMPLETED,
+  # Requests finished before the window expired still have results
+  'expired': BatchJobStatus.COMPLETED,
+  'failed': BatchJobStatus.FAILED,
+  'cancelled': BatchJobStatus.FAILED,
+}
+
+
+class OpenAiBatchJobClient(BatchJobClient):
+  def __init__(self, api_key: str, completion_window: str = '24h') -> None:
+    self._client = OpenAI(api_key=api_key)
+    self._completion_window = completion_window
+
+
+  def submit(self, requests: List[BatchJobRequest]) -> str:
+    lines = [json.dumps({
+      'custom_id': request.custom_id,
+      'method': 'POST',
+      'url': '/v1/chat/completions',
+      'body': to_chat_completion_arguments(request.request),
+    }) for request in requests]
+
+    input_file = self._client.files.create(
+      file=('batch_job.jsonl', '\n'.join(lines).encode('utf-8')),
+      purpose='batch')
+    batch = self._client.batches.create(
+      input_file_id=input_file.id,
+      endpoint='/v1/chat/completions',
+      completion_window=self._completion_window)
+    return batch.id
+
+
+  def get_status(self, job_id: str) -> BatchJobStatus:
+    batch = self._client.batches.retrieve(job_id)
+    return _TERMINAL_STATUSES.get(batch.status, BatchJobStatus.IN_PROGRESS)
+
+
+  def get_results(self, job_id: str) -> List[BatchJobResult]:
+    batch = self._client.batches.retrieve(job_id)
+    results = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+      if file_id:
+        results.extend(self._parse_result_line(line)
+                       for line in self._client.files.content(file_id).text.splitlines() if line.strip())
+    return results
+
+
+  def _parse_result_line(self, line: str) -> BatchJobResult:
+    result = json.loads(line)
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+      error = result.get('error') or response.get('body', {}).get('error')
+      return BatchJobResult(custom_id=result['custom_id'], error=json.dumps(error))
+
+    return BatchJobResult(
+      custom_id=result['custom_id'],
+      content=response['body']['choices'][0]['message']['content'])
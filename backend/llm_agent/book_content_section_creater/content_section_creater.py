@@ -1,52 +1,69 @@
 import json
 
-from openai import OpenAI
+from typing import Iterable, Iterator, Optional
 from repositories.book_content_section_repository.base import Page
-from llm_agent.costar_builder import CostarPromptBuilder
+from llm_agent.costar_builder import CompiledPrompt, CostarPromptBuilder
+from llm_agent.llm_cache.base import LlmResponseCache, make_cache_key
+from llm_agent.llm_client.base import LlmClient, LlmRequest
+from llm_agent.page_encoder.base import PageEncoder
+from llm_agent.page_encoder.delimited_encoder import DelimitedPageEncoder
+from llm_agent.token_budget import TokenBudgetPacker, TokenCounter
+
+def _compile_content_section_prompt(page_format:str) -> CompiledPrompt:
+  return CostarPromptBuilder().add_context(
+    ("You are the best book analyser in the world. "
+     "You are given a list of book pages in the PAGES section. "
+     f"{page_format} "
+    )
+  ).add_objective(
+    ("Your goal is to create appropriate content section according to content of the pages. "
+     "Each content section consist of pages that can be summerized all together. "
+     "Therefore each content section should revolve around single (or closely related) concepts. "
+     "Skip pages of 'Table of contents' and 'Appendix', do not include them in any final content sections. "
+     "")
+  ).add_response(
+    ("Return the answer in a json format, where each content section contains a start-page and end-page index, for example: "
+     '/{"content-sections" : [{"start-page":x, "end-page":y}, {"start-page":y+1, "end-page":z} ] /}')
+  ).compile('PAGES')
 
 
 class ContentSectionCreater:
-  def __init__(self, openai_api_key:str, model:str = 'gpt-4o-mini') -> None:
-    self._openai_api_key = openai_api_key
+  def __init__(self, llm_client:LlmClient, token_counter:TokenCounter,
+               model:str = 'gpt-4o-mini', page_token_budget:int = None,
+               response_cache:Optional[LlmResponseCache] = None,
+               page_encoder:Optional[PageEncoder] = None) -> None:
+    self._llm_client = llm_client
     self._model = model
+    self._response_cache = response_cache
+    self._page_encoder = page_encoder or DelimitedPageEncoder()
+    self._prompt = _compile_content_section_prompt(self._page_encoder.format_description)
+    self._page_packer = TokenBudgetPacker(token_counter, model, page_token_budget)
+
+  def iter_page_batches(self, pages:Iterable[Page]) -> Iterator[list[Page]]:
+    return self._page_packer.iter_packs(pages)
 
   def create_content_section_from_pages(self, pages:list[Page]) -> list[dict]:
-    client = OpenAI(api_key=self._openai_api_key)
-
-    prompt = CostarPromptBuilder().add_context(
-      ("You are the best book analyser in the world. "
-       f"Given a list of book pages: {json.dumps([p.model_dump() for p in pages])} "
-       "Each page contains a page number and its content. "
-      )
-    ).add_objective(
-      ("Your goal is to create appropriate content section according to content of the pages. "
-       "Each content section consist of pages that can be summerized all together. "
-       "Therefore each content section should revolve around single (or closely related) concepts. "
-       "Skip pages of 'Table of contents' and 'Appendix', do not include them in any final content sections. "
-       "")
-    ).add_response(
-      ("Return the answer in a json format, where each content section contains a start-page and end-page index, for example: "
-       '/{"content-sections" : [{"start-page":x, "end-page":y}, {"start-page":y+1, "end-page":z} ] /}')
-    ).build()
-    
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            }
-        ],
-        response_format={ "type": "json_object" },
+    prompt = self._prompt.render(self._page_encoder.encode(pages))
+    cache_key = make_cache_key(self._model, self._prompt.version, prompt)
+    content = self._response_cache.get(cache_key) if self._response_cache else None
+    cached = content is not None
+    if not cached:
+      content = self._llm_client.complete(LlmRequest(
         model=self._model,
-    )
+        prompt=prompt,
+        response_format={ "type": "json_object" }))
 
     book_ranges = []
 
-    result = json.loads(chat_completion.choices[0].message.content)
+    result = json.loads(content)
     for content_section in result['content-sections']:
       book_ranges.append({
         "start_page":content_section['start-page'],
         "end_page":content_section['end-page']
       })
+
+    # Only parsed responses are cached, a malformed one is requested again on retry
+    if not cached and self._response_cache:
+      self._response_cache.set(cache_key, content)
     
     return book_ranges
\ No newline at end of file
@@ -1,17 +1,155 @@
 import json
-import re 
-from time import time
-from openai import OpenAI
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
 from repositories.book_content_section_repository.base import Page
 from repositories.book_distilled_page_repository.base import DistilledPageParagraph
-from llm_agent.costar_builder import CostarPromptBuilder
+from llm_agent.book_content_section_distill.distilled_output_parser import DistilledOutputParser, parse_distilled_output
+from llm_agent.costar_builder import CompiledPrompt, CostarPromptBuilder
+from llm_agent.llm_cache.base import LlmResponseCache, make_cache_key
+from llm_agent.llm_client.base import LlmClient, LlmRequest
+from llm_agent.page_encoder.base import PageEncoder
+from llm_agent.page_encoder.delimited_encoder import DelimitedPageEncoder
+from llm_agent.token_budget import TokenBudgetPacker, TokenCounter
 
 MINIMUM_PARAGRAPH_LENGTH = 400
 
+
+def _compile_distill_prompt(page_format:str, response:str) -> CompiledPrompt:
+  return CostarPromptBuilder().add_context(
+  """
+  Your task is to create a distilled version of the pages taken out from a book, preserves its essence and impact while being more concise. Think of this as crafting a concentrated reading experience rather than a mere summary. 
+  The distilled version consist of two kinds of content:
+
+  1. Core content: The most important ideas, insights, and arguments of the original text.
+  2. Transition content: The content that connects the core content and help readers to follow the ideas of the author.
+
+  <Requirements for core content>:
+  Craft a flowing narrative that maintains the intellectual depth and distinctive perspective of the original text. 
+  Focus particularly on the author's original insights, counterintuitive propositions, and unique analytical framework. 
+  When encountering passages that offer groundbreaking perspectives or profound analysis, preserve them in their original form or with minimal modification - these moments are the heart of the work's contribution.
+  The result should feel like reading the original book in a more concentrated form - allowing readers to grasp the fundamental ideas, experience the author's perspective, and arrive at the same meaningful conclusions in less time.
+  However, do not sacrafice the coherent flow of the original work, use transition words and appropriate context for readers to follow the ideas of the author.
+  Essential elements to maintain:
+  - The author's distinctive voice, style, and intellectual approach
+  - Original and thought-provoking propositions that challenge conventional thinking
+  - Key arguments and the evidence that supports them
+  - Vivid examples and memorable moments that anchor complex concepts
+  - The logical progression that builds the author's unique perspective
+  - Significant passages that deserve to be quoted in full due to their exceptional insight or elegant expression
+  - The interconnections between ideas that reveal the author's broader philosophical or analytical framework
+  The goal is for readers to finish this concentrated version feeling they've truly experienced the heart of the work, not just learned about it.
+  Style the distilled version in a way that is engaging, interesting and easy to read.
+
+  <Requirements for transition content>:
+  The goal of the transition content is to form a coherent narrative that connects the core content and help readers to follow the ideas of the author. The transition content guild the readers 
+  from the last core content to the next core content, by briefly concluding the last core content and briefly introducing the next core content.
+  - You are encouraged to use thrid person narrative to generate the transition content.
+  - The transition content should be concise and to the point.
+  - The length of the transition content should be much shorter than the core content for the sake of maintaining the coherent flow of the original work.
+  - Create transition content in between the core content, only if necessary. If the core content is continuous and coherent, you can skip the transition content.
+
+  
+  """
+  ).add_objective(
+  f"""
+  Distill the pages given in the PAGES section.
+  {page_format}
+  """
+  ).add_response(response).compile('PAGES')
+
+
+MARKER_RESPONSE = """
+  For core content, indicate from which page/pages the different parts of the distilled version use information, by putting the page numbers as comma separated string in parentheses after the sentence e.g: (Core: x,y,z).
+  For transition content, indicate it is a transition content by adding the word "Transition" after the sentence. e.g: (Transition).
+
+  e.g:
+  This is sentence 1. Then this is sentence 2. (Core: 2,3,4) This is sentence 3. (Core: 5) This is a transtion content. (Transition) This is sentence 4. (Core: 6,7) This is another transition content. (Transition) This is sentence 5. (Core: 8,9,10,11)
+
+  {response_format}
+  """
+JSON_RESPONSE = MARKER_RESPONSE.format(
+  response_format='Return the answer in a json format: {"result" : "formatted distilled version"}')
+# Plain text, so markers can be parsed while the completion streams in
+STREAMING_RESPONSE = MARKER_RESPONSE.format(
+  response_format='Return only the formatted distilled version as plain text.')
+STRUCTURED_RESPONSE = """
+  Return the distilled version as its list of paragraphs in order, each paragraph is either core or transition content.
+  For core content, give the page numbers of the pages the paragraph uses information from.
+  For transition content, give an empty list of page numbers.
+  """
+
+# Paragraphs returned directly by the model, no marker parsing involved
+STRUCTURED_RESPONSE_FORMAT = {
+  'type': 'json_schema',
+  'json_schema': {
+    'name': 'distilled_paragraphs',
+    'strict': True,
+    'schema': {
+      'type': 'object',
+      'properties': {
+        'paragraphs': {
+          'type': 'array',
+          'items': {
+            'type': 'object',
+            'properties': {
+              'type': {'type': 'string', 'enum': ['core', 'transition']},
+              'content': {'type': 'string'},
+              'pages': {'type': 'array', 'items': {'type': 'integer'}},
+            },
+            'required': ['type', 'content', 'pages'],
+            'additionalProperties': False,
+          },
+        },
+      },
+      'required': ['paragraphs'],
+      'additionalProperties': False,
+    },
+  },
+}
+
+
 class ContentSectionDistiller:
-  def __init__(self, openai_api_key:str, model:str = 'gpt-4o-mini') -> None:
-    self._openai_api_key = openai_api_key
+  def __init__(self, llm_client:LlmClient, token_counter:TokenCounter,
+               model:str = 'gpt-4o-mini', page_token_budget:int = None,
+               response_cache:Optional[LlmResponseCache] = None,
+               page_encoder:Optional[PageEncoder] = None,
+               structured_output:bool = False, max_concurrency:int = 4) -> None:
+    self._llm_client = llm_client
     self._model = model
+    self._response_cache = response_cache
+    self._page_encoder = page_encoder or DelimitedPageEncoder()
+    self._structured_output = structured_output
+    page_format = self._page_encoder.format_description
+    self._prompt = _compile_distill_prompt(page_format, STRUCTURED_RESPONSE if structured_output else JSON_RESPONSE)
+    self._streaming_prompt = _compile_distill_prompt(page_format, STREAMING_RESPONSE)
+    self._page_packer = TokenBudgetPacker(token_counter, model, page_token_budget)
+    # Packs of one section distilled at once. Each call gets its own threads, so a section never waits
+    # behind the packs of other sections and its latency follows its largest pack, the rate limiter
+    # is what bounds the calls across sections
+    self._max_concurrency = max_concurrency
+
+
+  def pack_pages(self, book_pages:list[Page]) -> list[list[Page]]:
+    if not book_pages:
+      raise ValueError('No pages to distill')
+    # Packs are distilled concurrently, evened out so the largest one bounds the latency
+    return self._page_packer.pack_balanced(book_pages)
+
+
+  def stitch_chunks(self, chunk_paragraphs:list[list[DistilledPageParagraph]]) -> list[DistilledPageParagraph]:
+    """
+    Joins the paragraphs of consecutive page packs in order. A transition closing one pack and a
+    transition opening the next one become a single transition.
+    """
+    paragraphs = []
+    for chunk in chunk_paragraphs:
+      if paragraphs and chunk and paragraphs[-1].type == 'transition' and chunk[0].type == 'transition':
+        paragraphs[-1] = DistilledPageParagraph(
+          type='transition', content=paragraphs[-1].content + ' ' + chunk[0].content, pages=[])
+        chunk = chunk[1:]
+      paragraphs.extend(chunk)
+    return paragraphs
 
 
   def merge_paragraphs(self, paragraphs:list[DistilledPageParagraph]) -> list[DistilledPageParagraph]:
@@ -33,150 +171,111 @@ class ContentSectionDistiller:
 
 
   def summarize_content(self, book_pages:list[Page]) -> tuple[int, int, list[DistilledPageParagraph]]:
-    client = OpenAI(api_key=self._openai_api_key)
+    # Sections over the page token budget are distilled in several concurrent prompts and stitched
+    packs = self.pack_pages(book_pages)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(packs), self._max_concurrency))) as executor:
+      chunk_paragraphs = list(executor.map(self._distill_pages, packs))
+    merged_paragraphs = self.merge_paragraphs(self.stitch_chunks(chunk_paragraphs))
+    return book_pages[0].page_num, book_pages[-1].page_num, merged_paragraphs
 
-    prompt = CostarPromptBuilder().add_context(
-    """
-    Your task is to create a distilled version of the pages taken out from a book, preserves its essence and impact while being more concise. Think of this as crafting a concentrated reading experience rather than a mere summary. 
-    The distilled version consist of two kinds of content:
-
-    1. Core content: The most important ideas, insights, and arguments of the original text.
-    2. Transition content: The content that connects the core content and help readers to follow the ideas of the author.
-
-    <Requirements for core content>:
-    Craft a flowing narrative that maintains the intellectual depth and distinctive perspective of the original text. 
-    Focus particularly on the author's original insights, counterintuitive propositions, and unique analytical framework. 
-    When encountering passages that offer groundbreaking perspectives or profound analysis, preserve them in their original form or with minimal modification - these moments are the heart of the work's contribution.
-    The result should feel like reading the original book in a more concentrated form - allowing readers to grasp the fundamental ideas, experience the author's perspective, and arrive at the same meaningful conclusions in less time.
-    However, do not sacrafice the coherent flow of the original work, use transition words and appropriate context for readers to follow the ideas of the author.
-    Essential elements to maintain:
-    - The author's distinctive voice, style, and intellectual approach
-    - Original and thought-provoking propositions that challenge conventional thinking
-    - Key arguments and the evidence that supports them
-    - Vivid examples and memorable moments that anchor complex concepts
-    - The logical progression that builds the author's unique perspective
-    - Significant passages that deserve to be quoted in full due to their exceptional insight or elegant expression
-    - The interconnections between ideas that reveal the author's broader philosophical or analytical framework
-    The goal is for readers to finish this concentrated version feeling they've truly experienced the heart of the work, not just learned about it.
-    Style the distilled version in a way that is engaging, interesting and easy to read.
-
-    <Requirements for transition content>:
-    The goal of the transition content is to form a coherent narrative that connects the core content and help readers to follow the ideas of the author. The transition content guild the readers 
-    from the last core content to the next core content, by briefly concluding the last core content and briefly introducing the next core content.
-    - You are encouraged to use thrid person narrative to generate the transition content.
-    - The transition content should be concise and to the point.
-    - The length of the transition content should be much shorter than the core content for the sake of maintaining the coherent flow of the original work.
-    - Create transition content in between the core content, only if necessary. If the core content is continuous and coherent, you can skip the transition content.
 
-    
+  def stream_summarize_content(self, book_pages:list[Page],
+      on_paragraphs:Callable[[list[DistilledPageParagraph]], None],
+      background:bool = False) -> tuple[int, int, list[DistilledPageParagraph]]:
     """
-    ).add_objective(
-    f"""
-    Here are the pages to distill:
-    {json.dumps([page.model_dump() for page in book_pages])}
-    Each page contains a page_num and content
+    Same as summarize_content, but on_paragraphs is called with every paragraph finished so far
+    as soon as the model completes one. Background sections yield the rate limits to the others.
+    With structured_output the paragraphs of a pack only arrive once the whole pack is distilled.
     """
-    ).add_response(
-      ("""
-       For core content, indicate from which page/pages the different parts of the distilled version use information, by putting the page numbers as comma separated string in parentheses after the sentence e.g: (Core: x,y,z).
-       For transition content, indicate it is a transition content by adding the word "Transition" after the sentence. e.g: (Transition).
-       
-       e.g:
-       This is sentence 1. Then this is sentence 2. (Core: 2,3,4) This is sentence 3. (Core: 5) This is a transtion content. (Transition) This is sentence 4. (Core: 6,7) This is another transition content. (Transition) This is sentence 5. (Core: 8,9,10,11)
-       
-       Return the answer in a json format: 
-       """
-       '{"result" : "formatted distilled version"}'
-      )
-    
-    ).build()
-    
-    start_time = time()
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            }
-        ],
-        temperature=0.2,
-        response_format={ "type": "json_object" },
+    packs = self.pack_pages(book_pages)
+    chunk_paragraphs = [[]]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(packs) - 1, self._max_concurrency))) as executor:
+      # The first pack streams while the following ones are distilled concurrently
+      pending_chunks = [executor.submit(self._collect_streamed_pages, pages, background) for pages in packs[1:]]
+      for paragraphs in self._stream_distill_pages(packs[0], background):
+        chunk_paragraphs[0].extend(paragraphs)
+        on_paragraphs(self.merge_paragraphs(self.stitch_chunks(chunk_paragraphs)))
+
+      for pending_chunk in pending_chunks:
+        chunk_paragraphs.append(pending_chunk.result())
+        on_paragraphs(self.merge_paragraphs(self.stitch_chunks(chunk_paragraphs)))
+
+    merged_paragraphs = self.merge_paragraphs(self.stitch_chunks(chunk_paragraphs))
+    return book_pages[0].page_num, book_pages[-1].page_num, merged_paragraphs
+
+
+  def _collect_streamed_pages(self, book_pages:list[Page], background:bool) -> list[DistilledPageParagraph]:
+    return [paragraph for paragraphs in self._stream_distill_pages(book_pages, background) for paragraph in paragraphs]
+
+
+  def _stream_distill_pages(self, book_pages:list[Page], background:bool) -> Iterator[list[DistilledPageParagraph]]:
+    if self._structured_output:
+      # Schema constrained output can only be parsed once it is complete
+      yield self._distill_pages(book_pages, background)
+      return
+
+    prompt = self._streaming_prompt.render(self._page_encoder.encode(book_pages))
+    cache_key = make_cache_key(self._model, self._streaming_prompt.version, prompt)
+    content = self._response_cache.get(cache_key) if self._response_cache else None
+    if content is not None:
+      chunks = [content]
+    else:
+      chunks = self._llm_client.stream(LlmRequest(
         model=self._model,
-    )
-    end_time = time()
-    print(f'Time taken gpt: {end_time - start_time} seconds')
-
-    start_time = time()
-    result = json.loads(chat_completion.choices[0].message.content)
-    distilled_version = result['result']
-    print(distilled_version)
-
-    def parse_content_sections(text: str) -> list[dict]:
-      # First, let's split the text into sections based on both Core and Transition markers
-      sections = []
-      
-      # Match both Core and Transition sections
-      pattern = r'(.*?)(?:\(Core: ([0-9,\s]+)\)|\(Transition\))'
-      
-      # Find all matches including the last section
-      current_pos = 0
-      for match in re.finditer(pattern, text, re.DOTALL):
-          content = match.group(1).strip()
-          if not content:
-              continue
-          
-          content = content.strip(" .\n")
-          content = f'{content}.'
-
-          marker = text[match.start():match.end()]
-          current_pos = match.end()
-          
-          if 'Core:' in marker:
-              pages = [int(p.strip()) for p in match.group(2).split(',')]
-              sections.append({
-                  "type": "core",
-                  "pages": pages,
-                  "content": content
-              })
-          elif 'Transition' in marker:
-              sections.append({
-                  "type": "transition",
-                  "content": content
-              })
-      
-      # Handle the remaining text after the last marker
-      remaining = text[current_pos:].strip()
-      last_marker = re.search(r'\((Core: [0-9,\s]+|Transition)\)[^(]*$', text)
-      if last_marker and remaining:
-          if 'Core:' in last_marker.group(1):
-              pages = [int(p.strip()) for p in re.search(r'Core: ([0-9,\s]+)', last_marker.group(1)).group(1).split(',')]
-              sections.append({
-                  "type": "core",
-                  "pages": pages,
-                  "content": remaining
-              })
-          elif 'Transition' in last_marker.group(1):
-              sections.append({
-                  "type": "transition",
-                  "content": remaining
-              })
-      
-      return sections
-    
-    sections = parse_content_sections(distilled_version)
-    distilled_page_paragraphs = []
-    for section in sections:
-      if section['type'] == 'core':
-        distilled_page_paragraphs.append(DistilledPageParagraph(
-          type=section['type'], content=section['content'],
-          pages=section['pages']))
-      elif section['type'] == 'transition':
-        distilled_page_paragraphs.append(DistilledPageParagraph(
-          type=section['type'], content=section['content'], 
-          pages=[]))
-
-    merged_paragraphs = self.merge_paragraphs(distilled_page_paragraphs)
-    end_time = time()
-    print(f'Time taken formatting: {end_time - start_time} seconds')
-
-    return book_pages[0].page_num, book_pages[-1].page_num, merged_paragraphs
\ No newline at end of file
+        prompt=prompt,
+        temperature=0.2,
+        background=background))
+
+    parser = DistilledOutputParser()
+    received_chunks = []
+    for chunk in chunks:
+      received_chunks.append(chunk)
+      paragraphs = parser.feed(chunk)
+      if paragraphs:
+        yield paragraphs
+
+    paragraphs = parser.close()
+    if paragraphs:
+      yield paragraphs
+
+    # A truncated or unparsable completion is not cached, a retry requests it again
+    if content is None and self._response_cache and parser.is_complete:
+      self._response_cache.set(cache_key, ''.join(received_chunks))
+
+
+  def build_request(self, book_pages:list[Page], background:bool = False) -> LlmRequest:
+    """
+    The request distilling one pack of pages, see pack_pages.
+    """
+    return LlmRequest(
+      model=self._model,
+      prompt=self._prompt.render(self._page_encoder.encode(book_pages)),
+      temperature=0.2,
+      response_format=STRUCTURED_RESPONSE_FORMAT if self._structured_output else { "type": "json_object" },
+      background=background)
+
+
+  def _distill_pages(self, book_pages:list[Page], background:bool = False) -> list[DistilledPageParagraph]:
+    request = self.build_request(book_pages, background)
+    cache_key = make_cache_key(self._model, self._prompt.version, request.prompt)
+    content = self._response_cache.get(cache_key) if self._response_cache else None
+    if content is not None:
+      return self.parse_response(content)
+
+    content = self._llm_client.complete(request)
+    # Parsed before it is cached, a malformed response is requested again on retry
+    paragraphs = self.parse_response(content)
+    if self._response_cache:
+      self._response_cache.set(cache_key, content)
+    return paragraphs
+
+
+  def parse_response(self, content:str) -> list[DistilledPageParagraph]:
+    result = json.loads(content)
+    if self._structured_output:
+      return [DistilledPageParagraph(
+                type=paragraph['type'], content=paragraph['content'],
+                pages=paragraph['pages'] if paragraph['type'] == 'core' else [])
+              for paragraph in result['paragraphs'] if paragraph['content'].strip()]
+
+    return parse_distilled_output(result['result'])
@@ -0,0 +1,130 @@
+import re
+
+from typing import List, Optional
+
+from repositories.book_distilled_page_repository.base import DistilledPageParagraph
+
+# Longer parenthesized text is prose, also bounds the work spent on any candidate marker
+_MAX_MARKER_LENGTH = 80
+# Longest page range expanded from a marker, e.g. "(Core: 3-12)"
+_MAX_PAGE_RANGE_LENGTH = 80
+# Tolerates case, spacing, a missing colon and page ranges, e.g. "(core 3, 5-7)" or "( Transition )"
+_MARKER_PATTERN = re.compile(r'^\s*(core|transition)\s*:?\s*([0-9,\s\-–]*?)\s*$', re.IGNORECASE)
+_PAGE_RANGE_PATTERN = re.compile(r'(\d+)\s*[\-–]\s*(\d+)|(\d+)')
+
+
+def _parse_pages(text: str) -> List[int]:
+  pages = []
+  for match in _PAGE_RANGE_PATTERN.finditer(text):
+    if match.group(3) is not None:
+      pages.append(int(match.group(3)))
+    else:
+      start_page, end_page = int(match.group(1)), int(match.group(2))
+      if 0 <= end_page - start_page <= _MAX_PAGE_RANGE_LENGTH:
+        pages.extend(range(start_page, end_page + 1))
+  return list(dict.fromkeys(pages))
+
+
+class DistilledOutputParser:
+  """
+  Single pass parser for the "(Core: x,y)" / "(Transition)" marker format. Text is fed as it arrives,
+  every character is looked at a bounded number of times, and each paragraph is returned as soon as
+  its closing marker is complete. Parentheses that are not a valid marker stay in the prose.
+  """
+  def __init__(self) -> None:
+    self._content: List[str] = []
+    # Text after an opening parenthesis while it may still be a marker
+    self._marker: Optional[str] = None
+    self._last_type: Optional[str] = None
+    self._last_pages: List[int] = []
+    self._closed_in_marker = False
+
+
+  def feed(self, text: str) -> List[DistilledPageParagraph]:
+    paragraphs = []
+    pos = 0
+    while pos < len(text):
+      if self._marker is None:
+        start = text.find('(', pos)
+        if start == -1:
+          self._content.append(text[pos:])
+          break
+        self._content.append(text[pos:start])
+        self._marker = ''
+        pos = start + 1
+        continue
+
+      # Never looks past what could still belong to the marker, so each '(' costs bounded work
+      search_end = pos + _MAX_MARKER_LENGTH + 1 - len(self._marker)
+      end = text.find(')', pos, search_end)
+      piece = text[pos:search_end] if end == -1 else text[pos:end]
+      nested_start = piece.find('(')
+      if nested_start != -1:
+        # The earlier parenthesis was prose, rescan from the nested one
+        self._content.append(f'({self._marker}{piece[:nested_start]}')
+        self._marker = None
+        pos += nested_start
+        continue
+
+      self._marker += piece
+      pos += len(piece)
+      if len(self._marker) > _MAX_MARKER_LENGTH:
+        self._content.append(f'({self._marker}')
+        self._marker = None
+        continue
+      if end == -1:
+        break
+
+      pos += 1
+      marker, self._marker = self._marker, None
+      paragraph = self._close_paragraph(marker)
+      if paragraph:
+        paragraphs.append(paragraph)
+    return paragraphs
+
+
+  @property
+  def is_complete(self) -> bool:
+    """
+    Whether the text fed so far had at least one marker and did not end inside a marker, after close.
+    """
+    return self._last_type is not None and not self._closed_in_marker
+
+
+  def close(self) -> List[DistilledPageParagraph]:
+    if self._marker is not None:
+      self._closed_in_marker = True
+      self._content.append(f'({self._marker}')
+      self._marker = None
+
+    # Text after the last marker belongs to the same kind of content as that marker
+    remaining = ''.join(self._content).strip()
+    self._content = []
+    if not remaining or self._last_type is None:
+      return []
+    return [DistilledPageParagraph(type=self._last_type, content=remaining, pages=self._last_pages)]
+
+
+  def _close_paragraph(self, marker: str) -> Optional[DistilledPageParagraph]:
+    match = _MARKER_PATTERN.match(marker)
+    if not match:
+      self._content.append(f'({marker})')
+      return None
+
+    if match.group(1).lower() == 'core':
+      self._last_type = 'core'
+      self._last_pages = _parse_pages(match.group(2))
+    else:
+      self._last_type = 'transition'
+      self._last_pages = []
+
+    content = ''.join(self._content).strip(' .\n')
+    self._content = []
+    if not content:
+      return None
+    return DistilledPageParagraph(type=self._last_type, content=f'{content}.', pages=self._last_pages)
+
+
+def parse_distilled_output(text: str) -> List[DistilledPageParagraph]:
+  parser = DistilledOutputParser()
+  return parser.feed(text) + parser.close()
@@ -1,5 +1,7 @@
 from repositories.book_content_section_repository.base import Page
 from content_section_distiller import ContentSectionDistiller
+from llm_agent.llm_client.openai_client import OpenAiLlmClient
+from llm_agent.token_budget import TokenCounter
 
 
 import time
@@ -16,7 +18,7 @@ for page_number, page in enumerate(doc): # iterate the document pages
     page_num=page_number,
     content=page.get_text().strip()))
 
-distiller = ContentSectionDistiller(openai_api_key="")
+distiller = ContentSectionDistiller(llm_client=OpenAiLlmClient(api_key=""), token_counter=TokenCounter())
 
 start_time = time.time()
 distilled_page = distiller.summarize_content(book_pages=pages[75:86])
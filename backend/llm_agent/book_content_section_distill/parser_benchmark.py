@@ -0,0 +1,48 @@
+import argparse
+import random
+import time
+
+from llm_agent.book_content_section_distill.distilled_output_parser import DistilledOutputParser
+
+
+def make_output(paragraph_count: int, seed: int = 0) -> str:
+  rng = random.Random(seed)
+  words = ['the', 'author', 'argues', 'that', 'money', '(as a tool)', 'behaviour', 'matters', 'more', 'than']
+  paragraphs = []
+  for index in range(paragraph_count):
+    sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(20, 80)))
+    marker = '(Transition)' if index % 4 == 3 else f'(Core: {index}, {index + 1})'
+    paragraphs.append(f'{sentence}. {marker}')
+  return ' '.join(paragraphs)
+
+
+def parse(text: str, chunk_size: int) -> int:
+  parser = DistilledOutputParser()
+  paragraph_count = 0
+  for start in range(0, len(text), chunk_size):
+    paragraph_count += len(parser.feed(text[start:start + chunk_size]))
+  return paragraph_count + len(parser.close())
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Benchmark the distilled output parser, time should grow linearly')
+  parser.add_argument('--paragraphs', type=int, nargs='+', default=[1000, 2000, 4000, 8000])
+  parser.add_argument('--chunk-size', type=int, default=16)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  for paragraph_count in args.paragraphs:
+    text = make_output(paragraph_count)
+    timings = []
+    for _ in range(args.repeat):
+      start_time = time.perf_counter()
+      parsed_count = parse(text, args.chunk_size)
+      timings.append(time.perf_counter() - start_time)
+
+    best = min(timings)
+    print(f'paragraphs={parsed_count:>6} chars={len(text):>9} best={best:.3f}s '
+          f'mb/sec={len(text) / best / 1e6:.1f}')
+
+
+if __name__ == '__main__':
+  main()
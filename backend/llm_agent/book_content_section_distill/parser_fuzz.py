@@ -0,0 +1,42 @@
+import argparse
+import random
+
+from llm_agent.book_content_section_distill.distilled_output_parser import DistilledOutputParser, parse_distilled_output
+
+_FRAGMENTS = ['Some prose', ' ', '.', '(', ')', '((', '(Core: 1,2)', '(core 3-5)', '(Core: )', '(Transition)',
+              '( transition )', '(Core: 1,', '(see page 4)', '(Core: x)', '\n', '–', '金钱', '(Transition: 2)']
+
+
+def random_output(rng: random.Random) -> str:
+  return ''.join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(0, 60)))
+
+
+def parse_in_chunks(text: str, rng: random.Random):
+  parser = DistilledOutputParser()
+  paragraphs = []
+  pos = 0
+  while pos < len(text):
+    chunk_size = rng.randint(1, 8)
+    paragraphs.extend(parser.feed(text[pos:pos + chunk_size]))
+    pos += chunk_size
+  return paragraphs + parser.close()
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Fuzz the distilled output parser, chunked and whole parsing must agree')
+  parser.add_argument('--iterations', type=int, default=100000)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  for iteration in range(args.iterations):
+    text = random_output(rng)
+    expected = parse_distilled_output(text)
+    actual = parse_in_chunks(text, rng)
+    if actual != expected:
+      raise AssertionError(f'Iteration {iteration} differs for {text!r}:\n{expected}\n{actual}')
+  print(f'{args.iterations} iterations ok')
+
+
+if __name__ == '__main__':
+  main()
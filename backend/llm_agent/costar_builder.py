@@ -1,3 +1,29 @@
+import hashlib
+import inspect
+
+
+class CompiledPrompt:
+  """
+  Prompt template whose static sections are rendered once. The payload always goes last, so every
+  rendered prompt starts with the same byte-identical prefix and benefits from provider prefix caching.
+  """
+  def __init__(self, prefix:str, payload_title:str) -> None:
+    self._prefix = f'{prefix}# {payload_title} #\n\n'
+    # Changes with any change to the static sections, used in response cache keys
+    self._version = hashlib.sha256(self._prefix.encode('utf-8')).hexdigest()[:16]
+
+  @property
+  def prefix(self) -> str:
+    return self._prefix
+
+  @property
+  def version(self) -> str:
+    return self._version
+
+  def render(self, payload:str) -> str:
+    return f'{self._prefix}{payload}\n'
+
+
 class CostarPromptBuilder:
   def __init__(self) -> None:
     self._context = None
@@ -31,17 +57,21 @@ class CostarPromptBuilder:
     self._response = text
     return self
 
+  def compile(self, payload_title:str = 'INPUT') -> CompiledPrompt:
+    """
+    Compiles the sections added so far, they must not contain any per call data which goes into
+    the payload section given to CompiledPrompt.render instead.
+    """
+    self._validate()
+    sections = [('CONTEXT', self._context), ('OBJECTIVE', self._objective), ('STYLE', self._style),
+                ('TONE', self._tone), ('AUDIENCE', self._audience), ('RESPONSE', self._response)]
+    prefix = ''.join(f'# {title} #\n\n{inspect.cleandoc(text)}\n\n' for title, text in sections if text)
+    return CompiledPrompt(prefix, payload_title)
+
   def build(self) -> str:
-    if not self._context:
-      raise Exception('Prompt must contain a context, use add_context to add a context')
+    self._validate()
 
-    if not self._objective:
-      raise Exception('Prompt must contain an objective, use add_context to add an objective')
-    
-    if not self._response:
-      raise Exception('Prompt must contain an response, use add_context to add a response')
-      
-    prompt = '' 
+    prompt = ''
 
     prompt += f'''
     # CONTEXT #
@@ -87,4 +117,14 @@ class CostarPromptBuilder:
     {self._response}
     '''
 
-    return prompt
\ No newline at end of file
+    return prompt
+
+  def _validate(self) -> None:
+    if not self._context:
+      raise Exception('Prompt must contain a context, use add_context to add a context')
+
+    if not self._objective:
+      raise Exception('Prompt must contain an objective, use add_context to add an objective')
+    
+    if not self._response:
+      raise Exception('Prompt must contain an response, use add_context to add a response')
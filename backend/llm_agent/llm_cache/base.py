@@ -0,0 +1,66 @@
+import hashlib
+import logging
+import threading
+
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+def make_cache_key(model: str, template_version: str, prompt: str) -> str:
+  digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+  return hashlib.sha256(f'{model}:{template_version}:{digest}'.encode('utf-8')).hexdigest()
+
+
+class LlmCacheMetrics:
+  def __init__(self) -> None:
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._lock = threading.Lock()
+
+  def record(self, hit: bool) -> int:
+    """
+    Returns the number of lookups so far.
+    """
+    with self._lock:
+      if hit:
+        self.hits += 1
+      else:
+        self.misses += 1
+      return self.hits + self.misses
+
+  def record_evictions(self, count: int) -> None:
+    with self._lock:
+      self.evictions += count
+
+  @property
+  def hit_ratio(self) -> float:
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+  def snapshot(self) -> dict:
+    return {'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'hit_ratio': self.hit_ratio}
+
+
+class LlmResponseCache(ABC):
+  def __init__(self, metrics_log_interval: int = 100) -> None:
+    self.metrics = LlmCacheMetrics()
+    self._metrics_log_interval = metrics_log_interval
+
+  def get(self, key: str) -> Optional[str]:
+    response = self._load(key)
+    if self.metrics.record(hit=response is not None) % self._metrics_log_interval == 0:
+      logging.info(f"Llm cache metrics: {self.metrics.snapshot()}")
+    return response
+
+  def set(self, key: str, response: str) -> None:
+    self._store(key, response)
+
+  @abstractmethod
+  def _load(self, key: str) -> Optional[str]:
+    pass
+
+  @abstractmethod
+  def _store(self, key: str, response: str) -> None:
+    pass
@@ -0,0 +1,82 @@
+import threading
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import google.cloud.storage as storage
+from google.api_core.exceptions import NotFound
+
+from llm_agent.llm_cache.base import LlmResponseCache
+
+
+class GcsLlmResponseCache(LlmResponseCache):
+  """
+  Cache shared by every worker. Recency is tracked with the blob custom time, refreshed at most
+  once per touch_interval to keep hits cheap, and the least recently used blobs are evicted once
+  every evict_interval writes.
+  """
+  def __init__(self, bucket_name: str, max_size_bytes: int, prefix: str = 'llm-cache',
+               touch_interval: timedelta = timedelta(days=1), evict_interval: int = 200) -> None:
+    super().__init__()
+    self._client = storage.Client()
+    self._bucket = self._client.bucket(bucket_name)
+    self._max_size_bytes = max_size_bytes
+    self._prefix = prefix
+    self._touch_interval = touch_interval
+    self._evict_interval = evict_interval
+    self._store_count = 0
+    self._lock = threading.Lock()
+
+
+  def _load(self, key: str) -> Optional[str]:
+    blob = self._bucket.get_blob(self._blob_name(key))
+    if blob is None:
+      return None
+
+    try:
+      response = blob.download_as_text()
+    except NotFound:
+      # Evicted in between
+      return None
+
+    now = datetime.now(timezone.utc)
+    if blob.custom_time is None or now - blob.custom_time > self._touch_interval:
+      blob.custom_time = now
+      blob.patch()
+    return response
+
+
+  def _store(self, key: str, response: str) -> None:
+    blob = self._bucket.blob(self._blob_name(key))
+    blob.custom_time = datetime.now(timezone.utc)
+    blob.upload_from_string(response, content_type='text/plain; charset=utf-8')
+
+    with self._lock:
+      self._store_count += 1
+      should_evict = self._store_count % self._evict_interval == 0
+    if should_evict:
+      self.evict()
+
+
+  def evict(self) -> None:
+    blobs = list(self._client.list_blobs(self._bucket, prefix=f'{self._prefix}/'))
+    size_bytes = sum(blob.size for blob in blobs)
+    if size_bytes <= self._max_size_bytes:
+      return
+
+    evicted_count = 0
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    for blob in sorted(blobs, key=lambda b: b.custom_time or b.updated or oldest):
+      if size_bytes <= self._max_size_bytes:
+        break
+      try:
+        blob.delete()
+      except NotFound:
+        pass
+      size_bytes -= blob.size
+      evicted_count += 1
+    self.metrics.record_evictions(evicted_count)
+
+
+  def _blob_name(self, key: str) -> str:
+    return f'{self._prefix}/{key}'
@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+import time
+
+from typing import Optional
+
+from llm_agent.llm_cache.base import LlmResponseCache
+
+
+class SqliteLlmResponseCache(LlmResponseCache):
+  """
+  Local cache for a single worker, least recently used entries are evicted above max_size_bytes.
+  """
+  def __init__(self, path: str, max_size_bytes: int) -> None:
+    super().__init__()
+    self._max_size_bytes = max_size_bytes
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    self._connection.execute(
+      'CREATE TABLE IF NOT EXISTS llm_response ('
+      'key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)')
+    self._connection.execute(
+      'CREATE INDEX IF NOT EXISTS llm_response_last_access ON llm_response (last_access)')
+    self._connection.commit()
+    self._size_bytes = self._connection.execute(
+      'SELECT COALESCE(SUM(size), 0) FROM llm_response').fetchone()[0]
+
+
+  def _load(self, key: str) -> Optional[str]:
+    with self._lock:
+      row = self._connection.execute(
+        'SELECT response FROM llm_response WHERE key = ?', (key,)).fetchone()
+      if row is None:
+        return None
+
+      self._connection.execute(
+        'UPDATE llm_response SET last_access = ? WHERE key = ?', (time.time(), key))
+      self._connection.commit()
+      return row[0]
+
+
+  def _store(self, key: str, response: str) -> None:
+    size = len(response.encode('utf-8'))
+    with self._lock:
+      existing = self._connection.execute(
+        'SELECT size FROM llm_response WHERE key = ?', (key,)).fetchone()
+      self._connection.execute(
+        'INSERT OR REPLACE INTO llm_response (key, response, size, last_access) VALUES (?, ?, ?, ?)',
+        (key, response, size, time.time()))
+      self._size_bytes += size - (existing[0] if existing else 0)
+      self._evict()
+      self._connection.commit()
+
+
+  def _evict(self) -> None:
+    evicted_count = 0
+    while self._size_bytes > self._max_size_bytes:
+      rows = self._connection.execute(
+        'SELECT key, size FROM llm_response ORDER BY last_access LIMIT 64').fetchall()
+      if not rows:
+        break
+
+      for key, size in rows:
+        if self._size_bytes <= self._max_size_bytes:
+          break
+        self._connection.execute('DELETE FROM llm_response WHERE key = ?', (key,))
+        self._size_bytes -= size
+        evicted_count += 1
+
+    if evicted_count:
+      self.metrics.record_evictions(evicted_count)
@@ -0,0 +1,87 @@
+import json
+import threading
+
+from typing import Iterator
+from anthropic import Anthropic, AsyncAnthropic, RateLimitError
+
+from llm_agent.llm_client.base import LlmClient, LlmRateLimitError, LlmRequest, parse_retry_after
+
+# The messages api has no json mode, the answer is prefilled with the opening brace instead
+_JSON_PREFILL = '{'
+
+
+class AnthropicLlmClient(LlmClient):
+  """
+  Same contract as OpenAiLlmClient, response_format is emulated with instructions and a prefilled
+  answer. Requests must already name an anthropic model, see LlmRoute for the mapping.
+  """
+  def __init__(self, api_key: str, timeout: float = 120.0, max_tokens: int = 8192) -> None:
+    self._api_key = api_key
+    self._timeout = timeout
+    self._max_tokens = max_tokens
+    # No retries in the sdk, RateLimitedLlmClient waits on the shared limits and LlmRouter fails over
+    self._client = Anthropic(api_key=api_key, timeout=timeout, max_retries=0)
+    # Bound to the event loop it is first used in, so it is created lazily
+    self._async_client = None
+    self._lock = threading.Lock()
+
+
+  def complete(self, request: LlmRequest) -> str:
+    try:
+      message = self._client.messages.create(**self._to_arguments(request))
+    except RateLimitError as e:
+      raise LlmRateLimitError(str(e), parse_retry_after(e.response.headers)) from e
+    return self._get_prefill(request) + ''.join(block.text for block in message.content if block.type == 'text')
+
+
+  async def acomplete(self, request: LlmRequest) -> str:
+    try:
+      message = await self._get_async_client().messages.create(**self._to_arguments(request))
+    except RateLimitError as e:
+      raise LlmRateLimitError(str(e), parse_retry_after(e.response.headers)) from e
+    return self._get_prefill(request) + ''.join(block.text for block in message.content if block.type == 'text')
+
+
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    try:
+      with self._client.messages.stream(**self._to_arguments(request)) as message_stream:
+        prefill = self._get_prefill(request)
+        if prefill:
+          yield prefill
+        yield from message_stream.text_stream
+    except RateLimitError as e:
+      raise LlmRateLimitError(str(e), parse_retry_after(e.response.headers)) from e
+
+
+  def _get_async_client(self) -> AsyncAnthropic:
+    with self._lock:
+      if self._async_client is None:
+        self._async_client = AsyncAnthropic(
+          api_key=self._api_key, timeout=self._timeout, max_retries=0)
+      return self._async_client
+
+
+  def _get_prefill(self, request: LlmRequest) -> str:
+    return _JSON_PREFILL if request.response_format is not None else ''
+
+
+  def _to_arguments(self, request: LlmRequest) -> dict:
+    prompt = request.prompt
+    if request.response_format is not None:
+      prompt += '\n\nRespond with a single json object and nothing else.'
+      schema = request.response_format.get('json_schema', {}).get('schema')
+      if schema is not None:
+        prompt += f'\nThe json object must follow this json schema: {json.dumps(schema)}'
+
+    messages = [{'role': 'user', 'content': prompt}]
+    if request.response_format is not None:
+      messages.append({'role': 'assistant', 'content': _JSON_PREFILL})
+
+    arguments = {
+      'model': request.model,
+      'max_tokens': self._max_tokens,
+      'messages': messages,
+    }
+    if request.temperature is not None:
+      arguments['temperature'] = request.temperature
+    return arguments
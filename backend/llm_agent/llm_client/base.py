@@ -0,0 +1,98 @@
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+from pydantic import BaseModel
+
+
+class LlmRequest(BaseModel):
+  model: str
+  prompt: str
+  temperature: Optional[float] = None
+  response_format: Optional[dict] = None
+  # Background requests leave part of the rate limits to, and wait behind, the ones a user waits for
+  background: bool = False
+
+
+def parse_retry_after(headers) -> Optional[float]:
+  try:
+    if 'retry-after-ms' in headers:
+      return float(headers['retry-after-ms']) / 1000
+    if 'retry-after' in headers:
+      return float(headers['retry-after'])
+  except ValueError:
+    pass
+  return None
+
+
+class LlmRateLimitError(Exception):
+  def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+    super().__init__(message)
+    # Seconds the provider asked us to wait, when it said so
+    self.retry_after = retry_after
+
+
+class LlmTimeoutError(Exception):
+  pass
+
+
+class ProviderCallTimer:
+  """
+  Time spent on the provider by the request running under it, see active. Clients that queue calls
+  on rate limits report it through queued and started, so the time in their queue is not counted.
+  """
+  def __init__(self) -> None:
+    self._started_at = time.monotonic()
+    self._is_queued = False
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def current() -> Optional['ProviderCallTimer']:
+    return _provider_call_timer.get()
+
+  @contextmanager
+  def active(self) -> Iterator['ProviderCallTimer']:
+    token = _provider_call_timer.set(self)
+    try:
+      yield self
+    finally:
+      _provider_call_timer.reset(token)
+
+  def queued(self) -> None:
+    with self._lock:
+      self._is_queued = True
+
+  def started(self) -> None:
+    with self._lock:
+      self._is_queued = False
+      self._started_at = time.monotonic()
+
+  def elapsed(self) -> Optional[float]:
+    """
+    Seconds since the provider call started, None while it waits in a queue.
+    """
+    with self._lock:
+      return None if self._is_queued else time.monotonic() - self._started_at
+
+
+_provider_call_timer: ContextVar[Optional[ProviderCallTimer]] = ContextVar('provider_call_timer', default=None)
+
+
+class LlmClient(ABC):
+  @abstractmethod
+  def complete(self, request: LlmRequest) -> str:
+    pass
+
+  @abstractmethod
+  async def acomplete(self, request: LlmRequest) -> str:
+    pass
+
+  @abstractmethod
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    """
+    Yields the completion text in chunks as they arrive.
+    """
+    pass
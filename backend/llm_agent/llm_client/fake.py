@@ -0,0 +1,60 @@
+import asyncio
+import random
+import threading
+import time
+
+from typing import Callable, Iterator, Union
+
+from llm_agent.llm_client.base import LlmClient, LlmRateLimitError, LlmRequest
+
+
+class FakeLlmClient(LlmClient):
+  """
+  Local stand-in for a provider, for exercising routing, hedging and failover without any network
+  call. Failures are raised with the given probability, as rate limits when rate_limit_error is set.
+  """
+  def __init__(self, response: Union[str, Callable[[LlmRequest], str]] = '{}',
+               latency_seconds: float = 0.0, failure_rate: float = 0.0,
+               rate_limit_error: bool = False, chunk_size: int = 16, seed: int = None) -> None:
+    self._response = response
+    self._latency_seconds = latency_seconds
+    self._failure_rate = failure_rate
+    self._rate_limit_error = rate_limit_error
+    self._chunk_size = chunk_size
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self.request_count = 0
+
+
+  def complete(self, request: LlmRequest) -> str:
+    self._before_request(request)
+    time.sleep(self._latency_seconds)
+    return self._get_response(request)
+
+
+  async def acomplete(self, request: LlmRequest) -> str:
+    self._before_request(request)
+    await asyncio.sleep(self._latency_seconds)
+    return self._get_response(request)
+
+
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    self._before_request(request)
+    time.sleep(self._latency_seconds)
+    response = self._get_response(request)
+    for start in range(0, len(response), self._chunk_size):
+      yield response[start:start + self._chunk_size]
+
+
+  def _before_request(self, request: LlmRequest) -> None:
+    with self._lock:
+      self.request_count += 1
+      failed = self._random.random() < self._failure_rate
+    if failed and self._rate_limit_error:
+      raise LlmRateLimitError(f"Fake rate limit on model {request.model}", retry_after=0.0)
+    if failed:
+      raise RuntimeError(f"Fake failure on model {request.model}")
+
+
+  def _get_response(self, request: LlmRequest) -> str:
+    return self._response(request) if callable(self._response) else self._response
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import math
+import queue
+import threading
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Deque, Dict, Iterator, Optional
+
+from llm_agent.llm_client.base import LlmClient, LlmRequest, LlmTimeoutError, ProviderCallTimer
+from llm_agent.token_budget import TokenCounter
+
+
+class HedgeMetrics:
+  def __init__(self) -> None:
+    self.request_count = 0
+    self.hedge_count = 0
+    self.hedge_win_count = 0
+    self.timeout_count = 0
+    # Prompt tokens paid twice because of hedges, the losers' completions come on top
+    self.extra_prompt_token_count = 0
+    self._lock = threading.Lock()
+
+  def record_request(self) -> None:
+    with self._lock:
+      self.request_count += 1
+
+  def record_hedge(self, prompt_token_count: int) -> None:
+    with self._lock:
+      self.hedge_count += 1
+      self.extra_prompt_token_count += prompt_token_count
+
+  def record_hedge_win(self) -> None:
+    with self._lock:
+      self.hedge_win_count += 1
+
+  def record_timeout(self) -> None:
+    with self._lock:
+      self.timeout_count += 1
+
+  @property
+  def hedge_rate(self) -> float:
+    return self.hedge_count / self.request_count if self.request_count else 0.0
+
+  @property
+  def hedge_win_ratio(self) -> float:
+    return self.hedge_win_count / self.hedge_count if self.hedge_count else 0.0
+
+  def snapshot(self) -> dict:
+    return {'requests': self.request_count, 'hedges': self.hedge_count,
+            'hedge_wins': self.hedge_win_count, 'timeouts': self.timeout_count,
+            'hedge_rate': self.hedge_rate, 'hedge_win_ratio': self.hedge_win_ratio,
+            'extra_prompt_tokens': self.extra_prompt_token_count}
+
+
+class _LatencyTracker:
+  def __init__(self, window_size: int) -> None:
+    self._window_size = window_size
+    self._latencies: Dict[str, Deque[float]] = {}
+    self._lock = threading.Lock()
+
+  def record(self, model: str, latency: float) -> None:
+    with self._lock:
+      self._latencies.setdefault(model, deque(maxlen=self._window_size)).append(latency)
+
+  def percentile(self, model: str, percentile: float, min_sample_count: int) -> Optional[float]:
+    with self._lock:
+      latencies = sorted(self._latencies.get(model, ()))
+    if len(latencies) < min_sample_count:
+      return None
+    return latencies[min(len(latencies) - 1, math.ceil(percentile * len(latencies)) - 1)]
+
+
+def _first_chunk_key(model: str) -> str:
+  # Streams are tracked on their time to the first chunk, apart from full completions
+  return f'{model}:first-chunk'
+
+
+class _HedgeStream:
+  """
+  Reads one stream on its own thread into a queue shared with the other stream of the same request.
+  """
+  def __init__(self, llm_client: LlmClient, request: LlmRequest, events: queue.Queue,
+               latency_tracker: _LatencyTracker) -> None:
+    self._llm_client = llm_client
+    self._request = request
+    self._events = events
+    self._latency_tracker = latency_tracker
+    self._cancelled = threading.Event()
+    self.timer = ProviderCallTimer()
+
+  def start(self) -> None:
+    threading.Thread(target=self._run, daemon=True).start()
+
+  def cancel(self) -> None:
+    self._cancelled.set()
+
+  def _run(self) -> None:
+    chunks = None
+    try:
+      with self.timer.active():
+        chunks = self._llm_client.stream(self._request)
+        for index, chunk in enumerate(chunks):
+          if self._cancelled.is_set():
+            return
+          if index == 0:
+            self._latency_tracker.record(_first_chunk_key(self._request.model), self.timer.elapsed())
+          self._events.put((self, 'chunk', chunk))
+      self._events.put((self, 'end', None))
+    except Exception as e:
+      self._events.put((self, 'error', e))
+    finally:
+      # Closes the underlying http response of a cancelled stream
+      if hasattr(chunks, 'close'):
+        chunks.close()
+
+
+class HedgedLlmClient(LlmClient):
+  """
+  Sends a second request when the first one is slower than the given percentile of recent latencies
+  for its model, optionally on a faster fallback model, and returns whichever answers first.
+  A losing async request is cancelled. A losing sync request cannot be interrupted mid call, its
+  result is dropped when it completes. Streams are hedged on the time to their first chunk, the
+  first stream to produce a chunk wins and the other one is closed at its next chunk.
+  Latencies, hedge delays and the timeout only count time on the provider, not time waiting on
+  the rate limits, see ProviderCallTimer.
+  """
+  def __init__(self, llm_client: LlmClient, token_counter: TokenCounter,
+               fallback_models: Optional[Dict[str, str]] = None,
+               hedge_percentile: float = 0.95, default_hedge_delay_seconds: float = 30.0,
+               min_hedge_delay_seconds: float = 2.0, timeout_seconds: float = 180.0,
+               latency_window_size: int = 500, min_sample_count: int = 20,
+               max_workers: int = 64, queued_poll_seconds: float = 0.5) -> None:
+    self._llm_client = llm_client
+    self._token_counter = token_counter
+    self._fallback_models = fallback_models or {}
+    self._hedge_percentile = hedge_percentile
+    self._default_hedge_delay_seconds = default_hedge_delay_seconds
+    self._min_hedge_delay_seconds = min_hedge_delay_seconds
+    self._timeout_seconds = timeout_seconds
+    self._min_sample_count = min_sample_count
+    self._latency_tracker = _LatencyTracker(latency_window_size)
+    self._executor = ThreadPoolExecutor(max_workers=max_workers)
+    # How often a request still waiting on the rate limits is checked for its provider call start
+    self._queued_poll_seconds = queued_poll_seconds
+    self.metrics = HedgeMetrics()
+
+
+  def complete(self, request: LlmRequest) -> str:
+    self.metrics.record_request()
+    hedge_delay = min(self._get_hedge_delay(request.model), self._timeout_seconds)
+    timer = ProviderCallTimer()
+    primary = self._executor.submit(self._timed_complete, request, timer)
+    pending = {primary}
+    hedge = None
+    error = None
+    while pending:
+      if hedge is None and primary in pending and self._has_run(timer, hedge_delay):
+        hedge = self._executor.submit(self._timed_complete, self._to_hedge_request(request), ProviderCallTimer())
+        pending.add(hedge)
+      if self._has_run(timer, self._timeout_seconds):
+        break
+
+      done, pending = wait(pending, timeout=self._next_check(timer, hedge_delay if hedge is None else None),
+                           return_when=FIRST_COMPLETED)
+      for future in done:
+        if future.exception() is None:
+          self._on_winner(future is hedge, pending)
+          return future.result()
+        error = future.exception()
+
+    if error is not None and not pending:
+      raise error
+    for future in pending:
+      future.cancel()
+    self.metrics.record_timeout()
+    raise LlmTimeoutError(f"No response from model {request.model} within {self._timeout_seconds}s")
+
+
+  async def acomplete(self, request: LlmRequest) -> str:
+    self.metrics.record_request()
+    hedge_delay = min(self._get_hedge_delay(request.model), self._timeout_seconds)
+    timer = ProviderCallTimer()
+    primary = asyncio.ensure_future(self._atimed_complete(request, timer))
+    pending = {primary}
+    hedge = None
+    error = None
+    try:
+      while pending:
+        if hedge is None and primary in pending and self._has_run(timer, hedge_delay):
+          hedge = asyncio.ensure_future(self._atimed_complete(self._to_hedge_request(request), ProviderCallTimer()))
+          pending.add(hedge)
+        if self._has_run(timer, self._timeout_seconds):
+          break
+
+        done, pending = await asyncio.wait(
+          pending, timeout=self._next_check(timer, hedge_delay if hedge is None else None),
+          return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          if task.exception() is None:
+            self._on_winner(task is hedge, pending)
+            return task.result()
+          error = task.exception()
+    finally:
+      for task in pending:
+        task.cancel()
+
+    if error is not None and not pending:
+      raise error
+    self.metrics.record_timeout()
+    raise LlmTimeoutError(f"No response from model {request.model} within {self._timeout_seconds}s")
+
+
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    self.metrics.record_request()
+    hedge_delay = min(self._get_hedge_delay(_first_chunk_key(request.model)), self._timeout_seconds)
+    # Chunks, ends and errors of every stream in arrival order, tagged with their stream
+    events = queue.Queue()
+    streams = [_HedgeStream(self._llm_client, request, events, self._latency_tracker)]
+    streams[0].start()
+    timer = streams[0].timer
+    winner = None
+    failed_streams = set()
+    try:
+      while True:
+        hedge_due = winner is None and len(streams) == 1
+        try:
+          stream, kind, value = events.get(timeout=self._next_check(timer, hedge_delay if hedge_due else None))
+        except queue.Empty:
+          if self._has_run(timer, self._timeout_seconds):
+            self.metrics.record_timeout()
+            raise LlmTimeoutError(f"Stream from model {request.model} not done within {self._timeout_seconds}s")
+          if hedge_due and self._has_run(timer, hedge_delay):
+            streams.append(_HedgeStream(self._llm_client, self._to_hedge_request(request), events, self._latency_tracker))
+            streams[1].start()
+          continue
+
+        if winner is None:
+          if kind == 'error':
+            failed_streams.add(stream)
+            # Raised once no other stream can still answer
+            if len(failed_streams) == len(streams):
+              raise value
+            continue
+          winner = stream
+          self._on_winner(stream is not streams[0], [s for s in streams if s is not stream])
+        elif stream is not winner:
+          continue
+
+        if kind == 'error':
+          raise value
+        if kind == 'end':
+          return
+        yield value
+    finally:
+      for stream in streams:
+        stream.cancel()
+
+
+  def _has_run(self, timer: ProviderCallTimer, seconds: float) -> bool:
+    elapsed = timer.elapsed()
+    return elapsed is not None and elapsed >= seconds
+
+
+  def _next_check(self, timer: ProviderCallTimer, hedge_delay: Optional[float]) -> float:
+    """
+    Seconds until the request is due a hedge or its timeout, soon again while it is still queued.
+    """
+    elapsed = timer.elapsed()
+    if elapsed is None:
+      return self._queued_poll_seconds
+    due = self._timeout_seconds if hedge_delay is None else min(hedge_delay, self._timeout_seconds)
+    if elapsed >= due:
+      due = self._timeout_seconds
+    return max(0.0, due - elapsed)
+
+
+  def _get_hedge_delay(self, model: str) -> float:
+    delay = self._latency_tracker.percentile(model, self._hedge_percentile, self._min_sample_count)
+    if delay is None:
+      return self._default_hedge_delay_seconds
+    return max(self._min_hedge_delay_seconds, delay)
+
+
+  def _to_hedge_request(self, request: LlmRequest) -> LlmRequest:
+    hedge_request = request.model_copy(update={'model': self._fallback_models.get(request.model, request.model)})
+    self.metrics.record_hedge(self._token_counter.count(request.prompt, hedge_request.model))
+    logging.info(f"Hedging slow request on model {request.model} with model {hedge_request.model}")
+    return hedge_request
+
+
+  def _on_winner(self, is_hedge: bool, pending: set) -> None:
+    if is_hedge:
+      self.metrics.record_hedge_win()
+    for future in pending:
+      future.cancel()
+    if self.metrics.request_count % 100 == 0:
+      logging.info(f"Hedge metrics: {self.metrics.snapshot()}")
+
+
+  def _timed_complete(self, request: LlmRequest, timer: ProviderCallTimer) -> str:
+    with timer.active():
+      content = self._llm_client.complete(request)
+    self._latency_tracker.record(request.model, timer.elapsed())
+    return content
+
+
+  async def _atimed_complete(self, request: LlmRequest, timer: ProviderCallTimer) -> str:
+    with timer.active():
+      content = await self._llm_client.acomplete(request)
+    self._latency_tracker.record(request.model, timer.elapsed())
+    return content
@@ -0,0 +1,88 @@
+import threading
+import httpx
+
+from typing import Iterator
+from openai import AsyncOpenAI, OpenAI, RateLimitError
+
+from llm_agent.llm_client.base import LlmClient, LlmRateLimitError, LlmRequest, parse_retry_after
+
+
+def to_chat_completion_arguments(request: LlmRequest) -> dict:
+  arguments = {
+    'model': request.model,
+    'messages': [{'role': 'user', 'content': request.prompt}],
+  }
+  if request.temperature is not None:
+    arguments['temperature'] = request.temperature
+  if request.response_format is not None:
+    arguments['response_format'] = request.response_format
+  return arguments
+
+
+class OpenAiLlmClient(LlmClient):
+  """
+  One client per process, the underlying http connection pools are reused across calls so only the
+  first request to a host pays for the tls handshake.
+  """
+  def __init__(self, api_key: str, timeout: float = 120.0, connect_timeout: float = 10.0,
+               max_connections: int = 100, max_keepalive_connections: int = 20,
+               keepalive_expiry: float = 60.0) -> None:
+    self._api_key = api_key
+    self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+    self._limits = httpx.Limits(
+      max_connections=max_connections,
+      max_keepalive_connections=max_keepalive_connections,
+      keepalive_expiry=keepalive_expiry)
+
+    # No retries in the sdk, RateLimitedLlmClient waits on the shared limits and LlmRouter fails over
+    self._client = OpenAI(
+      api_key=api_key,
+      max_retries=0,
+      timeout=self._timeout,
+      http_client=httpx.Client(limits=self._limits, timeout=self._timeout))
+    # httpx.AsyncClient is bound to the event loop it is first used in, so it is created lazily
+    self._async_client = None
+    self._lock = threading.Lock()
+
+
+  def complete(self, request: LlmRequest) -> str:
+    try:
+      chat_completion = self._client.chat.completions.create(**to_chat_completion_arguments(request))
+    except RateLimitError as e:
+      raise LlmRateLimitError(str(e), parse_retry_after(e.response.headers)) from e
+    return chat_completion.choices[0].message.content
+
+
+  async def acomplete(self, request: LlmRequest) -> str:
+    try:
+      chat_completion = await self._get_async_client().chat.completions.create(**to_chat_completion_arguments(request))
+    except RateLimitError as e:
+      raise LlmRateLimitError(str(e), parse_retry_after(e.response.headers)) from e
+    return chat_completion.choices[0].message.content
+
+
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    try:
+      chunks = self._client.chat.completions.create(stream=True, **to_chat_completion_arguments(request))
+    except RateLimitError as e:
+      raise LlmRateLimitError(str(e), parse_retry_after(e.response.headers)) from e
+
+    with chunks:
+      for chunk in chunks:
+        if chunk.choices and chunk.choices[0].delta.content:
+          yield chunk.choices[0].delta.content
+
+
+  def close(self) -> None:
+    self._client.close()
+
+
+  def _get_async_client(self) -> AsyncOpenAI:
+    with self._lock:
+      if self._async_client is None:
+        self._async_client = AsyncOpenAI(
+          api_key=self._api_key,
+          max_retries=0,
+          timeout=self._timeout,
+          http_client=httpx.AsyncClient(limits=self._limits, timeout=self._timeout))
+      return self._async_client
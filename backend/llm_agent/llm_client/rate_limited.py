@@ -0,0 +1,91 @@
+import logging
+
+from typing import Iterator
+
+from llm_agent.llm_client.base import LlmClient, LlmRateLimitError, LlmRequest, ProviderCallTimer
+from llm_agent.rate_limit_scheduler import RateLimitScheduler
+from llm_agent.token_budget import TokenCounter
+
+
+class RateLimitedLlmClient(LlmClient):
+  def __init__(self, llm_client: LlmClient, scheduler: RateLimitScheduler,
+               token_counter: TokenCounter, completion_token_estimate: int = 1024,
+               max_retries: int = 5, backoff_seconds: float = 2.0) -> None:
+    self._llm_client = llm_client
+    self._scheduler = scheduler
+    self._token_counter = token_counter
+    self._completion_token_estimate = completion_token_estimate
+    self._max_retries = max_retries
+    self._backoff_seconds = backoff_seconds
+
+
+  def complete(self, request: LlmRequest) -> str:
+    token_count = self._estimate_token_count(request)
+    for attempt in range(self._max_retries + 1):
+      self._acquire(request, token_count)
+      try:
+        return self._llm_client.complete(request)
+      except LlmRateLimitError as e:
+        self._on_rate_limited(request, e, attempt)
+
+
+  async def acomplete(self, request: LlmRequest) -> str:
+    token_count = self._estimate_token_count(request)
+    for attempt in range(self._max_retries + 1):
+      await self._aacquire(request, token_count)
+      try:
+        return await self._llm_client.acomplete(request)
+      except LlmRateLimitError as e:
+        self._on_rate_limited(request, e, attempt)
+
+
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    token_count = self._estimate_token_count(request)
+    for attempt in range(self._max_retries + 1):
+      self._acquire(request, token_count)
+      try:
+        chunks = self._llm_client.stream(request)
+        # Rate limits are reported when the stream is opened, before any text is yielded
+        first_chunk = next(chunks, None)
+      except LlmRateLimitError as e:
+        self._on_rate_limited(request, e, attempt)
+        continue
+
+      if first_chunk is not None:
+        yield first_chunk
+      yield from chunks
+      return
+
+
+  def _acquire(self, request: LlmRequest, token_count: int) -> None:
+    timer = ProviderCallTimer.current()
+    if timer:
+      timer.queued()
+    self._scheduler.acquire(request.model, token_count, request.background)
+    if timer:
+      timer.started()
+
+
+  async def _aacquire(self, request: LlmRequest, token_count: int) -> None:
+    timer = ProviderCallTimer.current()
+    if timer:
+      timer.queued()
+    await self._scheduler.aacquire(request.model, token_count, request.background)
+    if timer:
+      timer.started()
+
+
+  def _on_rate_limited(self, request: LlmRequest, error: LlmRateLimitError, attempt: int) -> None:
+    if attempt == self._max_retries:
+      raise error
+
+    retry_after = error.retry_after or self._backoff_seconds * 2 ** attempt
+    logging.warning(f"Rate limited on model {request.model}, waiting {retry_after:.1f}s, "
+                    f"queue depth: {self._scheduler.queue_depth()}")
+    # Every queued call for the model waits, not only this one
+    self._scheduler.penalize(request.model, retry_after)
+
+
+  def _estimate_token_count(self, request: LlmRequest) -> int:
+    # Providers count the expected completion against the tokens-per-minute limit as well
+    return self._token_counter.count(request.prompt, request.model) + self._completion_token_estimate
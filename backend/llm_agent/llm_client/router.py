@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from typing import Dict, Iterator, List, Optional
+
+from llm_agent.llm_client.base import LlmClient, LlmRequest
+from llm_agent.rate_limit_scheduler import RateLimitScheduler
+
+
+class LlmRoute:
+  """
+  One provider account behind the router. The scheduler must be the one its client acquires from,
+  so its headroom reflects the calls going through the route.
+  """
+  def __init__(self, name: str, llm_client: LlmClient, scheduler: RateLimitScheduler,
+               models: Optional[Dict[str, str]] = None) -> None:
+    self.name = name
+    self.llm_client = llm_client
+    self.scheduler = scheduler
+    # Requested model to provider model, None serves every model under its own name
+    self.models = models
+
+
+  def serves(self, model: str) -> bool:
+    return self.models is None or model in self.models
+
+
+  def to_provider_request(self, request: LlmRequest) -> LlmRequest:
+    if self.models is None:
+      return request
+    return request.model_copy(update={'model': self.models[request.model]})
+
+
+class _RouteStats:
+  def __init__(self) -> None:
+    self.latency_seconds: Optional[float] = None
+    self.unhealthy_until = 0.0
+
+
+class LlmRouter(LlmClient):
+  """
+  Spreads calls over several provider routes, weighted by remaining rate limit headroom over the
+  observed latency of each route. A failing call moves on to the next best route, and the failing
+  route is avoided for a cooldown period.
+  """
+  def __init__(self, routes: List[LlmRoute], latency_smoothing: float = 0.2,
+               default_latency_seconds: float = 10.0, failure_cooldown_seconds: float = 30.0,
+               min_headroom: float = 0.01, seed: int = None) -> None:
+    if not routes:
+      raise ValueError('At least one llm route is required')
+    self._routes = routes
+    self._latency_smoothing = latency_smoothing
+    self._default_latency_seconds = default_latency_seconds
+    self._failure_cooldown_seconds = failure_cooldown_seconds
+    self._min_headroom = min_headroom
+    self._random = random.Random(seed)
+    self._stats = {route.name: _RouteStats() for route in routes}
+    self._lock = threading.Lock()
+
+
+  def complete(self, request: LlmRequest) -> str:
+    error = None
+    for route in self._order_routes(request.model):
+      start_time = time.monotonic()
+      try:
+        content = route.llm_client.complete(route.to_provider_request(request))
+      except Exception as e:
+        error = e
+        self._on_failure(route, request, e)
+        continue
+      self._on_success(route, time.monotonic() - start_time)
+      return content
+    raise error
+
+
+  async def acomplete(self, request: LlmRequest) -> str:
+    error = None
+    for route in self._order_routes(request.model):
+      start_time = time.monotonic()
+      try:
+        content = await route.llm_client.acomplete(route.to_provider_request(request))
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        error = e
+        self._on_failure(route, request, e)
+        continue
+      self._on_success(route, time.monotonic() - start_time)
+      return content
+    raise error
+
+
+  def stream(self, request: LlmRequest) -> Iterator[str]:
+    error = None
+    for route in self._order_routes(request.model):
+      start_time = time.monotonic()
+      try:
+        chunks = route.llm_client.stream(route.to_provider_request(request))
+        # Failing over is only possible before any text was handed out
+        first_chunk = next(chunks, None)
+      except Exception as e:
+        error = e
+        self._on_failure(route, request, e)
+        continue
+
+      # Time to first chunk, the rest depends on the length of the answer
+      self._on_success(route, time.monotonic() - start_time)
+      if first_chunk is not None:
+        yield first_chunk
+      yield from chunks
+      return
+    raise error
+
+
+  def _order_routes(self, model: str) -> List[LlmRoute]:
+    routes = [route for route in self._routes if route.serves(model)]
+    if not routes:
+      raise ValueError(f'No llm route serves model {model}')
+
+    now = time.monotonic()
+    with self._lock:
+      healthy = [r for r in routes if self._stats[r.name].unhealthy_until <= now]
+      unhealthy = [r for r in routes if self._stats[r.name].unhealthy_until > now]
+      # Routes without samples yet are assumed as fast as the others, so they get traffic at all
+      latencies = [self._stats[r.name].latency_seconds for r in routes if self._stats[r.name].latency_seconds]
+      unknown_latency = sum(latencies) / len(latencies) if latencies else self._default_latency_seconds
+      scores = {r.name: self._score(r, model, unknown_latency) for r in healthy}
+      ordered = sorted(healthy, key=lambda r: scores[r.name], reverse=True)
+      # The first route is drawn in proportion to its score so load is spread instead of all going
+      # to whichever route looks best right now, the others follow by score for failover
+      if len(ordered) > 1:
+        first = self._random.choices(ordered, weights=[scores[r.name] for r in ordered])[0]
+        ordered.remove(first)
+        ordered.insert(0, first)
+
+    # Every route failed recently, still try them rather than failing outright
+    return ordered + unhealthy
+
+
+  def _score(self, route: LlmRoute, model: str, unknown_latency: float) -> float:
+    provider_model = route.models[model] if route.models is not None else model
+    headroom = max(self._min_headroom, route.scheduler.headroom(provider_model))
+    latency = self._stats[route.name].latency_seconds or unknown_latency
+    return headroom / latency
+
+
+  def _on_success(self, route: LlmRoute, latency: float) -> None:
+    with self._lock:
+      stats = self._stats[route.name]
+      stats.unhealthy_until = 0.0
+      if stats.latency_seconds is None:
+        stats.latency_seconds = latency
+      else:
+        stats.latency_seconds += self._latency_smoothing * (latency - stats.latency_seconds)
+
+
+  def _on_failure(self, route: LlmRoute, request: LlmRequest, error: Exception) -> None:
+    logging.warning(f"Llm route {route.name} failed for model {request.model}, failing over: {error}")
+    with self._lock:
+      self._stats[route.name].unhealthy_until = time.monotonic() + self._failure_cooldown_seconds
@@ -0,0 +1,45 @@
+from abc import ABC, abstractmethod
+from typing import List
+from pydantic import BaseModel
+
+from llm_agent.token_budget import TokenCounter
+from repositories.book_content_section_repository.base import Page
+
+
+class PageEncodingReport(BaseModel):
+  page_count: int
+  token_count_before: int
+  token_count_after: int
+
+  @property
+  def tokens_per_page_before(self) -> float:
+    return self.token_count_before / self.page_count if self.page_count else 0.0
+
+  @property
+  def tokens_per_page_after(self) -> float:
+    return self.token_count_after / self.page_count if self.page_count else 0.0
+
+
+class PageEncoder(ABC):
+  """
+  Serializes pages into the payload of a prompt.
+  """
+  @property
+  @abstractmethod
+  def format_description(self) -> str:
+    """
+    Tells the llm how pages are laid out, part of the static prompt instructions.
+    """
+    pass
+
+  @abstractmethod
+  def encode(self, pages: List[Page]) -> str:
+    pass
+
+
+def compare_page_encoders(pages: List[Page], before: PageEncoder, after: PageEncoder,
+                          token_counter: TokenCounter, model: str) -> PageEncodingReport:
+  return PageEncodingReport(
+    page_count=len(pages),
+    token_count_before=token_counter.count(before.encode(pages), model),
+    token_count_after=token_counter.count(after.encode(pages), model))
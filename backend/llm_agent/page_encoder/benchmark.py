@@ -0,0 +1,28 @@
+import argparse
+
+from llm_agent.page_encoder.base import compare_page_encoders
+from llm_agent.page_encoder.delimited_encoder import DelimitedPageEncoder
+from llm_agent.page_encoder.json_encoder import JsonPageEncoder
+from llm_agent.token_budget import TokenCounter
+from pdf_loader.pymupdf_loader import PymupdfLoader
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Compare prompt tokens per page of the page encoders')
+  parser.add_argument('file_path')
+  parser.add_argument('--model', default='gpt-4o-mini')
+  args = parser.parse_args()
+
+  pages = PymupdfLoader().load_pdf(args.file_path)
+  token_counter = TokenCounter()
+  baseline = JsonPageEncoder(ensure_ascii=True)
+  for name, encoder in [('json', JsonPageEncoder()), ('delimited', DelimitedPageEncoder())]:
+    report = compare_page_encoders(pages, baseline, encoder, token_counter, args.model)
+    print(f'{name:>10} pages={report.page_count} '
+          f'tokens/page json-escaped={report.tokens_per_page_before:.1f} '
+          f'{name}={report.tokens_per_page_after:.1f} '
+          f'saved={1 - report.token_count_after / max(report.token_count_before, 1):.1%}')
+
+
+if __name__ == '__main__':
+  main()
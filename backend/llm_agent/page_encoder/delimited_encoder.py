@@ -0,0 +1,21 @@
+from typing import List
+
+from llm_agent.page_encoder.base import PageEncoder
+from repositories.book_content_section_repository.base import Page
+
+
+class DelimitedPageEncoder(PageEncoder):
+  """
+  Raw utf-8 page content behind a one line header carrying the page number, no escaping and no
+  keys repeated on every page.
+  """
+  def __init__(self, delimiter: str = '<<<PAGE {page_num}>>>') -> None:
+    self._delimiter = delimiter
+
+  @property
+  def format_description(self) -> str:
+    return (f"Each page starts with a line {self._delimiter.format(page_num='n')}, "
+            "where n is its page number, followed by the content of the page.")
+
+  def encode(self, pages: List[Page]) -> str:
+    return '\n'.join(f'{self._delimiter.format(page_num=page.page_num)}\n{page.content}' for page in pages)
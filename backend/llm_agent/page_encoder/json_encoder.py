@@ -0,0 +1,22 @@
+import json
+
+from typing import List
+
+from llm_agent.page_encoder.base import PageEncoder
+from repositories.book_content_section_repository.base import Page
+
+
+class JsonPageEncoder(PageEncoder):
+  """
+  The original format, a json list of {"page_num", "content"} objects. With ensure_ascii every
+  non ascii character becomes a 6 character escape, which is what compact encoders are measured against.
+  """
+  def __init__(self, ensure_ascii: bool = False) -> None:
+    self._ensure_ascii = ensure_ascii
+
+  @property
+  def format_description(self) -> str:
+    return "The pages are a json list, each page contains a page_num and content."
+
+  def encode(self, pages: List[Page]) -> str:
+    return json.dumps([page.model_dump() for page in pages], ensure_ascii=self._ensure_ascii)
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+from typing import Dict, Tuple
+
+# (requests per minute, tokens per minute) per model
+DEFAULT_MODEL_RATE_LIMITS = {
+  'gpt-4o': (5000, 800000),
+  'gpt-4o-mini': (5000, 4000000),
+}
+
+
+class TokenBucket:
+  def __init__(self, per_minute: float) -> None:
+    self.capacity = per_minute
+    self._rate = per_minute / 60
+    self._level = per_minute
+    self._updated = time.monotonic()
+
+  def wait_time(self, amount: float, now: float, reserve_ratio: float = 0.0) -> float:
+    self._refill(now)
+    # A request larger than the whole bucket only waits for a full bucket
+    needed = min(amount + reserve_ratio * self.capacity, self.capacity)
+    return 0.0 if self._level >= needed else (needed - self._level) / self._rate
+
+  def consume(self, amount: float) -> None:
+    self._level -= min(amount, self.capacity)
+
+  def available_ratio(self, now: float) -> float:
+    self._refill(now)
+    return max(0.0, self._level) / self.capacity
+
+  def _refill(self, now: float) -> None:
+    self._level = min(self.capacity, self._level + (now - self._updated) * self._rate)
+    self._updated = now
+
+
+class _ModelBudget:
+  def __init__(self, requests_per_minute: float, tokens_per_minute: float) -> None:
+    self.requests = TokenBucket(requests_per_minute)
+    self.tokens = TokenBucket(tokens_per_minute)
+    self.blocked_until = 0.0
+    self.queue_depth = 0
+    self.foreground_queue_depth = 0
+    # Counted only while background calls are queued, reset by every background grant
+    self.foreground_grants_since_background = 0
+
+
+class RateLimitScheduler:
+  """
+  Keeps the calls of this process inside per model requests-per-minute and tokens-per-minute
+  budgets. Calls wait until both buckets can cover them, and a 429 with retry-after blocks the
+  model for that long. Background calls wait while any other call of the model is queued, and
+  leave background_reserve_ratio of both buckets to the other calls. So they are never starved,
+  queued background calls still get background_min_share of the grants: once it is their turn,
+  other calls only go ahead while the buckets hold more than the reserve.
+  """
+  def __init__(self, model_rate_limits: Dict[str, Tuple[float, float]] = None,
+               default_rate_limit: Tuple[float, float] = (500, 200000),
+               max_sleep_seconds: float = 1.0, background_reserve_ratio: float = 0.2,
+               background_min_share: float = 0.2) -> None:
+    self._model_rate_limits = model_rate_limits or DEFAULT_MODEL_RATE_LIMITS
+    self._default_rate_limit = default_rate_limit
+    self._max_sleep_seconds = max_sleep_seconds
+    self._background_reserve_ratio = background_reserve_ratio
+    # Foreground grants between two background turns, None never gives background calls a turn
+    self._foreground_grants_per_background = (
+      max(1, round((1 - background_min_share) / background_min_share)) if background_min_share > 0 else None)
+    self._budgets: Dict[str, _ModelBudget] = {}
+    self._lock = threading.Lock()
+
+
+  def acquire(self, model: str, token_count: int, background: bool = False) -> None:
+    self._change_queue_depth(model, 1, background)
+    try:
+      while True:
+        delay = self._try_acquire(model, token_count, background)
+        if delay == 0:
+          return
+        time.sleep(min(delay, self._max_sleep_seconds))
+    finally:
+      self._change_queue_depth(model, -1, background)
+
+
+  async def aacquire(self, model: str, token_count: int, background: bool = False) -> None:
+    self._change_queue_depth(model, 1, background)
+    try:
+      while True:
+        delay = self._try_acquire(model, token_count, background)
+        if delay == 0:
+          return
+        await asyncio.sleep(min(delay, self._max_sleep_seconds))
+    finally:
+      self._change_queue_depth(model, -1, background)
+
+
+  def penalize(self, model: str, retry_after: float) -> None:
+    with self._lock:
+      budget = self._get_budget(model)
+      budget.blocked_until = max(budget.blocked_until, time.monotonic() + retry_after)
+
+
+  def headroom(self, model: str) -> float:
+    """
+    Share of the tighter of the two budgets of the model available right now, 0 while blocked.
+    """
+    with self._lock:
+      budget = self._get_budget(model)
+      now = time.monotonic()
+      if budget.blocked_until > now:
+        return 0.0
+      return min(budget.requests.available_ratio(now), budget.tokens.available_ratio(now))
+
+
+  def queue_depth(self) -> Dict[str, int]:
+    with self._lock:
+      return {model: budget.queue_depth for model, budget in self._budgets.items()}
+
+
+  def _try_acquire(self, model: str, token_count: int, background: bool) -> float:
+    with self._lock:
+      budget = self._get_budget(model)
+      now = time.monotonic()
+      background_queued = budget.queue_depth > budget.foreground_queue_depth
+      background_turn = (background_queued and self._foreground_grants_per_background is not None and
+                         budget.foreground_grants_since_background >= self._foreground_grants_per_background)
+      if background:
+        if budget.foreground_queue_depth > 0 and not background_turn:
+          return self._max_sleep_seconds
+        # On its turn the call draws from the whole buckets, the other calls keep off the reserve
+        reserve_ratio = 0.0 if background_turn else self._background_reserve_ratio
+      else:
+        reserve_ratio = self._background_reserve_ratio if background_turn else 0.0
+      delay = max(budget.blocked_until - now,
+                  budget.requests.wait_time(1, now, reserve_ratio),
+                  budget.tokens.wait_time(token_count, now, reserve_ratio))
+      if delay <= 0:
+        budget.requests.consume(1)
+        budget.tokens.consume(token_count)
+        if background:
+          budget.foreground_grants_since_background = 0
+        elif background_queued:
+          budget.foreground_grants_since_background += 1
+        return 0
+      return delay
+
+
+  def _change_queue_depth(self, model: str, change: int, background: bool) -> None:
+    with self._lock:
+      budget = self._get_budget(model)
+      budget.queue_depth += change
+      if not background:
+        budget.foreground_queue_depth += change
+
+
+  def _get_budget(self, model: str) -> _ModelBudget:
+    if model not in self._budgets:
+      self._budgets[model] = _ModelBudget(*self._model_rate_limits.get(model, self._default_rate_limit))
+    return self._budgets[model]
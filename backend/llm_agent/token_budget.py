@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import re
+import threading
+import tiktoken
+
+from collections import OrderedDict
+from typing import Iterable, Iterator, List
+
+from repositories.book_content_section_repository.base import Page
+
+# Token budget for the page payload of a single prompt, leaves room for instructions and the response
+MODEL_PAGE_TOKEN_BUDGETS = {
+  'gpt-4o': 24000,
+  'gpt-4o-mini': 48000,
+}
+DEFAULT_PAGE_TOKEN_BUDGET = 16000
+
+# Page number and separators added around every page when it is serialized into a prompt
+PAGE_OVERHEAD_TOKENS = 12
+
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+
+def get_page_token_budget(model: str) -> int:
+  return MODEL_PAGE_TOKEN_BUDGETS.get(model, DEFAULT_PAGE_TOKEN_BUDGET)
+
+
+class TokenCounter:
+  def __init__(self, cache_size: int = 200000) -> None:
+    self._cache_size = cache_size
+    self._cache = OrderedDict()
+    self._encodings = {}
+    self._lock = threading.Lock()
+
+
+  def count(self, text: str, model: str) -> int:
+    encoding = self._get_encoding(model)
+    if encoding is None:
+      return self._estimate(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+  def count_page(self, page: Page, model: str) -> int:
+    encoding = self._get_encoding(model)
+    key = (encoding.name if encoding else 'estimate',
+           hashlib.blake2b(page.content.encode('utf-8'), digest_size=16).digest())
+
+    with self._lock:
+      if key in self._cache:
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    token_count = self.count(page.content, model) + PAGE_OVERHEAD_TOKENS
+    with self._lock:
+      self._cache[key] = token_count
+      if len(self._cache) > self._cache_size:
+        self._cache.popitem(last=False)
+    return token_count
+
+
+  def _get_encoding(self, model: str):
+    if model not in self._encodings:
+      try:
+        try:
+          self._encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+          self._encodings[model] = tiktoken.get_encoding('o200k_base')
+      except Exception:
+        # Encoding files could not be loaded (e.g. no network on first use)
+        logging.warning(f"Tokenizer unavailable for model {model}, falling back to estimation")
+        self._encodings[model] = None
+    return self._encodings[model]
+
+
+  def _estimate(self, text: str) -> int:
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+class TokenBudgetPacker:
+  def __init__(self, token_counter: TokenCounter, model: str, token_budget: int = None) -> None:
+    self._token_counter = token_counter
+    self._model = model
+    self._token_budget = token_budget or get_page_token_budget(model)
+
+
+  @property
+  def token_budget(self) -> int:
+    return self._token_budget
+
+
+  def count_pages(self, pages: Iterable[Page]) -> int:
+    return sum(self._token_counter.count_page(page, self._model) for page in pages)
+
+
+  def pack(self, pages: Iterable[Page]) -> List[List[Page]]:
+    return list(self.iter_packs(pages))
+
+
+  def iter_packs(self, pages: Iterable[Page]) -> Iterator[List[Page]]:
+    # Pages must stay contiguous, so greedily filling each prompt gives the fewest prompts.
+    # A single page over budget is sent on its own.
+    pack = []
+    pack_token_count = 0
+    for page in pages:
+      page_token_count = self._token_counter.count_page(page, self._model)
+      if pack and pack_token_count + page_token_count > self._token_budget:
+        yield pack
+        pack = []
+        pack_token_count = 0
+
+      pack.append(page)
+      pack_token_count += page_token_count
+
+    if pack:
+      yield pack
+
+
+  def pack_balanced(self, pages: List[Page]) -> List[List[Page]]:
+    """
+    Same number of packs as pack, with token counts evened out so no pack is much larger than
+    the others, for packs that are processed concurrently.
+    """
+    packs = self.pack(pages)
+    if len(packs) < 2:
+      return packs
+
+    target_token_count = self.count_pages(pages) / len(packs)
+    balanced_packs = []
+    pack = []
+    pack_token_count = 0
+    for page in pages:
+      page_token_count = self._token_counter.count_page(page, self._model)
+      # Cut when the page would take the pack further past the target than stopping short of it
+      if (pack and len(balanced_packs) < len(packs) - 1 and
+          (pack_token_count + page_token_count > self._token_budget or
+           pack_token_count + page_token_count / 2 > target_token_count)):
+        balanced_packs.append(pack)
+        pack = []
+        pack_token_count = 0
+
+      pack.append(page)
+      pack_token_count += page_token_count
+
+    balanced_packs.append(pack)
+    if pack_token_count > self._token_budget:
+      return packs
+    return balanced_packs
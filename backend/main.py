@@ -79,4 +79,10 @@ def process_content_distill(event: Dict[str, Any], context: Any) -> None:
     except Exception as e:
       logger.error(f"Error processing message: {str(e)}")
       logger.error(traceback.format_exc())
-      raise e
\ No newline at end of file
+      raise e
+
+def process_content_distill_background(event: Dict[str, Any], context: Any) -> None:
+    """Cloud Function entry point for the background (prefetch) Pub/Sub topic."""
+    # Jobs carry their priority, so they are handled the same way. A separate function caps the
+    # instances spent on background work
+    process_content_distill(event, context)
@@ -0,0 +1,153 @@
+import threading
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, Optional
+from pydantic import BaseModel
+
+from message_broker.pubsub_message_broker import JobDeferredError
+
+
+class _Tenant:
+  def __init__(self, virtual_time: float) -> None:
+    self.pending_jobs: Deque[BaseModel] = deque()
+    self.in_flight_count = 0
+    # Advances by 1 / weight with every job started, the lowest one goes next
+    self.virtual_time = virtual_time
+
+
+class FairJobQueue:
+  """
+  Local buffer of pulled jobs, bucketed by tenant. Jobs are handed out by weighted round robin across
+  tenants, so a tenant with many jobs only delays the others by its share, and no tenant has more than
+  max_in_flight_per_tenant jobs started and not yet done. See has_room for max_pending_per_tenant.
+  """
+  def __init__(self, tenant_key: Callable[[BaseModel], str],
+               tenant_weight: Callable[[BaseModel], float] = lambda job: 1.0,
+               max_in_flight_per_tenant: int = 1,
+               max_pending_per_tenant: Optional[int] = None) -> None:
+    self._tenant_key = tenant_key
+    self._tenant_weight = tenant_weight
+    self._max_in_flight_per_tenant = max_in_flight_per_tenant
+    self._max_pending_per_tenant = max_pending_per_tenant
+    self._tenants: Dict[str, _Tenant] = {}
+    # Pending and in flight jobs, unacked messages are delivered again and must not run twice
+    self._job_keys = set()
+    self._lock = threading.Lock()
+
+
+  def __len__(self) -> int:
+    with self._lock:
+      return sum(len(tenant.pending_jobs) for tenant in self._tenants.values())
+
+
+  def has_room(self, job: BaseModel) -> bool:
+    """
+    Whether the tenant of the job has fewer than max_pending_per_tenant jobs waiting to start.
+    """
+    if self._max_pending_per_tenant is None:
+      return True
+    with self._lock:
+      tenant = self._tenants.get(self._tenant_key(job))
+      return tenant is None or len(tenant.pending_jobs) < self._max_pending_per_tenant
+
+
+  def push(self, job: BaseModel) -> bool:
+    """
+    Returns False when the same job is already pending or in flight.
+    """
+    job_key = job.model_dump_json()
+    with self._lock:
+      if job_key in self._job_keys:
+        return False
+      self._job_keys.add(job_key)
+
+      tenant_key = self._tenant_key(job)
+      tenant = self._tenants.get(tenant_key)
+      if tenant is None:
+        # A new tenant starts level with the others instead of catching up on the time it was idle
+        tenant = _Tenant(min((t.virtual_time for t in self._tenants.values()), default=0.0))
+        self._tenants[tenant_key] = tenant
+      tenant.pending_jobs.append(job)
+      return True
+
+
+  def pop(self) -> Optional[BaseModel]:
+    """
+    Returns None when no tenant with pending jobs is under its in flight cap.
+    """
+    with self._lock:
+      eligible_tenants = [tenant for tenant in self._tenants.values()
+                          if tenant.pending_jobs and tenant.in_flight_count < self._max_in_flight_per_tenant]
+      if not eligible_tenants:
+        return None
+
+      tenant = min(eligible_tenants, key=lambda t: t.virtual_time)
+      job = tenant.pending_jobs.popleft()
+      tenant.in_flight_count += 1
+      tenant.virtual_time += 1.0 / max(self._tenant_weight(job), 1e-6)
+      return job
+
+
+  def done(self, job: BaseModel) -> None:
+    tenant_key = self._tenant_key(job)
+    with self._lock:
+      self._job_keys.discard(job.model_dump_json())
+      tenant = self._tenants[tenant_key]
+      tenant.in_flight_count -= 1
+      if not tenant.pending_jobs and tenant.in_flight_count == 0:
+        del self._tenants[tenant_key]
+
+
+class FairJobGate:
+  """
+  Holds the thread of each delivered job until the FairJobQueue hands the job out and one of the
+  max_running slots is free. Jobs are delivered ahead of the running ones, so the queue sees every
+  tenant waiting and not only the oldest job. A job whose tenant has no room left in the queue is
+  deferred back to the subscription, so one tenant never fills the delivered jobs.
+  """
+  def __init__(self, job_queue: FairJobQueue, max_running: int, defer_seconds: float = 30.0) -> None:
+    self._job_queue = job_queue
+    self._max_running = max_running
+    self._defer_seconds = defer_seconds
+    self._running_count = 0
+    self._granted_job_keys = set()
+    self._condition = threading.Condition()
+
+
+  @contextmanager
+  def turn(self, job: BaseModel) -> Iterator[bool]:
+    """
+    Yields False right away when the same job is already pending or in flight, raises
+    JobDeferredError when the tenant of the job has no room left.
+    """
+    job_key = job.model_dump_json()
+    with self._condition:
+      if not self._job_queue.has_room(job):
+        raise JobDeferredError(f"Deferring job of a tenant with no room left: {job_key}", self._defer_seconds)
+      pushed = self._job_queue.push(job)
+      if pushed:
+        self._dispatch()
+        self._condition.wait_for(lambda: job_key in self._granted_job_keys)
+        self._granted_job_keys.discard(job_key)
+
+    if not pushed:
+      yield False
+      return
+    try:
+      yield True
+    finally:
+      with self._condition:
+        self._job_queue.done(job)
+        self._running_count -= 1
+        self._dispatch()
+
+
+  def _dispatch(self) -> None:
+    while self._running_count < self._max_running:
+      job = self._job_queue.pop()
+      if job is None:
+        break
+      self._granted_job_keys.add(job.model_dump_json())
+      self._running_count += 1
+    self._condition.notify_all()
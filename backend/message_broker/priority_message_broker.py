@@ -0,0 +1,59 @@
+import logging
+import math
+
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+from google.cloud.pubsub_v1.subscriber.futures import StreamingPullFuture
+from pydantic import BaseModel
+
+from message_broker.pubsub_message_broker import MessageBroker
+
+
+class JobPriority(str, Enum):
+  # A reader is waiting for the result
+  INTERACTIVE = "INTERACTIVE"
+  # Prefetch and backfill
+  BACKGROUND = "BACKGROUND"
+
+
+class PriorityMessageBroker:
+  """
+  One topic and subscription per priority, jobs are routed by their priority field. The highest
+  priority gets the full concurrency of a worker, every lower priority gets its own share of it on top,
+  so it never starves behind a steady stream of higher priority jobs nor delays them.
+  """
+  def __init__(self, message_brokers: Dict[JobPriority, MessageBroker],
+               low_priority_shares: Optional[Dict[JobPriority, float]] = None) -> None:
+    # Highest priority first, in the declaration order of JobPriority
+    self._priorities = [priority for priority in JobPriority if priority in message_brokers]
+    self._message_brokers = message_brokers
+    self._low_priority_shares = low_priority_shares or {}
+
+
+  def publish_job(self, model: BaseModel) -> None:
+    priority = getattr(model, 'priority', None) or self._priorities[0]
+    self._message_brokers[priority].publish_job(model)
+
+
+  def subscribe(self, handler: Callable[[BaseModel], None], max_concurrency: int,
+                **kwargs) -> List[StreamingPullFuture]:
+    futures = []
+    for priority in self._priorities:
+      concurrency = max_concurrency
+      if priority != self._priorities[0]:
+        concurrency = max(1, math.ceil(max_concurrency * self._low_priority_shares.get(priority, 0.0)))
+      logging.info(f"Subscribing to priority {priority.value} with concurrency {concurrency}")
+      futures.append(self._message_brokers[priority].subscribe(handler, concurrency, **kwargs))
+    return futures
+
+
+  def get_queue_depths(self) -> Dict[JobPriority, Optional[int]]:
+    queue_depths = {}
+    for priority in self._priorities:
+      try:
+        queue_depths[priority] = self._message_brokers[priority].get_queue_depth()
+      except Exception:
+        logging.exception(f"Could not get the queue depth of priority {priority.value}")
+        queue_depths[priority] = None
+    return queue_depths
+
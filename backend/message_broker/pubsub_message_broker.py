@@ -1,6 +1,28 @@
-from typing import Optional, Type
-from google.cloud import pubsub_v1
-from pydantic import BaseModel
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Type
+from google.cloud import monitoring_v3, pubsub_v1
+from google.cloud.pubsub_v1.subscriber.futures import StreamingPullFuture
+from google.cloud.pubsub_v1.subscriber.message import Message
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+from pydantic import BaseModel, ValidationError
+
+# Upper bound pubsub puts on a modified ack deadline
+_MAX_ACK_DEADLINE_SECONDS = 600
+_MAX_TRACKED_FAILURES = 10000
+
+
+class JobDeferredError(Exception):
+  """
+  Raised by a handler to give a job back to the subscription for delay_seconds, without counting as
+  a failure, so other messages can be delivered in the meantime.
+  """
+  def __init__(self, message: str, delay_seconds: float) -> None:
+    super().__init__(message)
+    self.delay_seconds = delay_seconds
 
 
 class MessageBroker:
@@ -8,12 +30,14 @@ class MessageBroker:
                pubsub_topic: str,
                pubsub_subscriptor: pubsub_v1.SubscriberClient,
                pubsub_subscription: str,
-               model_type: Type[BaseModel]) -> None:
+               model_type: Type[BaseModel],
+               metric_client: Optional[monitoring_v3.MetricServiceClient] = None) -> None:
     self._pubsub_topic = pubsub_topic
     self._pubsub_publisher = pubsub_publisher
     self._pubsub_subscriptor = pubsub_subscriptor
     self._pubsub_subscription = pubsub_subscription
     self._model_type = model_type
+    self._metric_client = metric_client
 
 
   def publish_job(self, model: BaseModel) -> None:
@@ -23,22 +47,81 @@ class MessageBroker:
     )
   
 
-  def get_next_job(self) -> Optional[BaseModel]:
-    
-    response = self._pubsub_subscriptor.pull(
-        request={
-            "subscription": self._pubsub_subscription,
-            "max_messages": 1,
-        }
-    )
+  def subscribe(self, handler: Callable[[BaseModel], None], max_concurrency: int,
+                max_lease_seconds: float = 3600, min_backoff_seconds: float = 10,
+                max_backoff_seconds: float = 600) -> StreamingPullFuture:
+    """
+    Runs handler on up to max_concurrency jobs at once over a streaming pull, more messages are not
+    leased until a job finishes. Ack deadlines are extended while a job runs, up to max_lease_seconds.
+    A job is acked when handler returns, and redelivered after an exponential backoff when it raises,
+    or after the requested delay when it raises JobDeferredError.
+    """
+    failure_counts: Dict[str, int] = {}
+    failure_counts_lock = threading.Lock()
+
+    def callback(message: Message) -> None:
+      try:
+        job = self._model_type.model_validate_json(message.data.decode('utf-8'))
+      except ValidationError:
+        # Redelivering a malformed message can never succeed
+        logging.exception(f"Dropping malformed message: {message.message_id}")
+        message.ack()
+        return
+
+      try:
+        handler(job)
+      except JobDeferredError as e:
+        message.modify_ack_deadline(int(min(e.delay_seconds, _MAX_ACK_DEADLINE_SECONDS)))
+        message.drop()
+        return
+      except Exception:
+        with failure_counts_lock:
+          if len(failure_counts) >= _MAX_TRACKED_FAILURES:
+            failure_counts.pop(next(iter(failure_counts)))
+          failure_count = failure_counts.get(message.message_id, 0) + 1
+          failure_counts[message.message_id] = failure_count
+        # delivery_attempt is only set when the subscription has a dead letter policy
+        attempt = message.delivery_attempt or failure_count
+        backoff_seconds = min(max_backoff_seconds, min_backoff_seconds * 2 ** (attempt - 1), _MAX_ACK_DEADLINE_SECONDS)
+        logging.exception(f"Job failed on attempt {attempt}, retrying in {backoff_seconds}s: {job.model_dump_json()}")
+        # Left to expire instead of nacked, so the message comes back only after the backoff
+        message.modify_ack_deadline(int(backoff_seconds))
+        message.drop()
+        return
+
+      with failure_counts_lock:
+        failure_counts.pop(message.message_id, None)
+      message.ack()
+
+    return self._pubsub_subscriptor.subscribe(
+      self._pubsub_subscription,
+      callback=callback,
+      flow_control=pubsub_v1.types.FlowControl(
+        max_messages=max_concurrency, max_lease_duration=max_lease_seconds),
+      scheduler=ThreadScheduler(ThreadPoolExecutor(
+        max_workers=max_concurrency, thread_name_prefix=self._pubsub_subscription.split('/')[-1])))
 
-    # Check if we received any messages
-    if not response.received_messages:
-        return None
 
-    received_message = response.received_messages[0]
+  def get_queue_depth(self) -> Optional[int]:
+    """
+    Undelivered messages of the subscription as last reported by cloud monitoring, which lags
+    by about a minute. None when it is not known.
+    """
+    if self._metric_client is None:
+      return None
 
-    # The actual message data is in received_message.message.data
-    return self._model_type.model_validate_json(
-        received_message.message.data.decode('utf-8')
-    )
\ No newline at end of file
+    # projects/{project}/subscriptions/{subscription}
+    _, project_id, _, subscription_id = self._pubsub_subscription.split('/')
+    now = int(time.time())
+    time_series_list = self._metric_client.list_time_series(request={
+      "name": f"projects/{project_id}",
+      "filter": ('metric.type = "pubsub.googleapis.com/subscription/num_undelivered_messages" AND '
+                 f'resource.labels.subscription_id = "{subscription_id}"'),
+      "interval": monitoring_v3.TimeInterval(end_time={"seconds": now}, start_time={"seconds": now - 300}),
+      "view": monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL,
+    })
+    for time_series in time_series_list:
+      # Newest point first
+      if time_series.points:
+        return time_series.points[0].value.int64_value
+    return None
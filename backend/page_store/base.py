@@ -0,0 +1,14 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+from repositories.book_content_section_repository.base import Page
+
+
+class PageStore(ABC):
+  @abstractmethod
+  def save_pages(self, book_id: str, pages: List[Page]) -> None:
+    pass
+
+  @abstractmethod
+  def get_pages(self, book_id: str, start_page: int, end_page: int) -> List[Page]:
+    pass
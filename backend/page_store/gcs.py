@@ -0,0 +1,110 @@
+import bisect
+import json
+import struct
+import threading
+import zlib
+
+from collections import OrderedDict
+from typing import List, Tuple
+
+import google.cloud.storage as storage
+from google.api_core.exceptions import NotFound
+
+from page_store.base import PageStore
+from repositories.book_content_section_repository.base import Page
+
+# Blob layout: MAGIC | index length (8 bytes) | zlib(json index) | one zlib frame per page.
+# The index holds [page_num, offset, length] for every frame, sorted by page_num, so a page
+# range is a single ranged read.
+MAGIC = b'SRPAGES1'
+HEADER_SIZE = len(MAGIC) + 8
+HEAD_READ_SIZE = 64 * 1024
+
+
+class GcsPageStore(PageStore):
+  def __init__(self, bucket_name: str, prefix: str = 'pages', index_cache_size: int = 256) -> None:
+    self._client = storage.Client()
+    self._bucket = self._client.bucket(bucket_name)
+    self._prefix = prefix
+    self._index_cache_size = index_cache_size
+    self._index_cache = OrderedDict()
+    self._lock = threading.Lock()
+
+
+  def save_pages(self, book_id: str, pages: List[Page]) -> None:
+    pages_by_num = {page.page_num: page for page in pages}
+
+    index = []
+    frames = []
+    offset = 0
+    for page_num in sorted(pages_by_num):
+      frame = zlib.compress(pages_by_num[page_num].content.encode('utf-8'))
+      index.append([page_num, offset, len(frame)])
+      frames.append(frame)
+      offset += len(frame)
+
+    index_bytes = zlib.compress(json.dumps(index).encode('utf-8'))
+    data = MAGIC + struct.pack('>Q', len(index_bytes)) + index_bytes + b''.join(frames)
+    self._bucket.blob(self._blob_name(book_id)).upload_from_string(
+      data, content_type='application/octet-stream')
+
+    with self._lock:
+      self._index_cache.pop(book_id, None)
+
+
+  def get_pages(self, book_id: str, start_page: int, end_page: int) -> List[Page]:
+    try:
+      return self._read_pages(book_id, start_page, end_page)
+    except NotFound:
+      # The cached generation was replaced by a newer save, reload the index once
+      with self._lock:
+        self._index_cache.pop(book_id, None)
+      return self._read_pages(book_id, start_page, end_page)
+
+
+  def _read_pages(self, book_id: str, start_page: int, end_page: int) -> List[Page]:
+    generation, data_offset, index = self._get_index(book_id)
+    page_nums = [entry[0] for entry in index]
+    entries = index[bisect.bisect_left(page_nums, start_page):bisect.bisect_right(page_nums, end_page)]
+    if not entries:
+      return []
+
+    first_offset = entries[0][1]
+    last_offset = entries[-1][1] + entries[-1][2]
+    blob = self._bucket.blob(self._blob_name(book_id), generation=generation)
+    data = blob.download_as_bytes(start=data_offset + first_offset, end=data_offset + last_offset - 1)
+
+    return [Page(page_num=page_num,
+                 content=zlib.decompress(data[offset - first_offset:offset - first_offset + length]).decode('utf-8'))
+            for page_num, offset, length in entries]
+
+
+  def _get_index(self, book_id: str) -> Tuple[int, int, list]:
+    with self._lock:
+      if book_id in self._index_cache:
+        self._index_cache.move_to_end(book_id)
+        return self._index_cache[book_id]
+
+    blob = self._bucket.get_blob(self._blob_name(book_id))
+    if blob is None:
+      raise ValueError(f'No page store blob for book: {book_id}')
+
+    head = blob.download_as_bytes(start=0, end=HEAD_READ_SIZE - 1)
+    if head[:len(MAGIC)] != MAGIC:
+      raise ValueError(f'Invalid page store blob for book: {book_id}')
+
+    index_length = struct.unpack('>Q', head[len(MAGIC):HEADER_SIZE])[0]
+    data_offset = HEADER_SIZE + index_length
+    if data_offset > len(head):
+      head += blob.download_as_bytes(start=len(head), end=data_offset - 1)
+    index = json.loads(zlib.decompress(head[HEADER_SIZE:data_offset]))
+
+    with self._lock:
+      self._index_cache[book_id] = (blob.generation, data_offset, index)
+      if len(self._index_cache) > self._index_cache_size:
+        self._index_cache.popitem(last=False)
+    return blob.generation, data_offset, index
+
+
+  def _blob_name(self, book_id: str) -> str:
+    return f'{self._prefix}/{book_id}'
@@ -1,9 +1,28 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterator, List, Union
+
+from pydantic import BaseModel
+
+from repositories.book_content_section_repository.base import Page
+
+
+class OutlineEntry(BaseModel):
+  level: int
+  title: str
+  # 0 based, same as Page.page_num
+  page_num: int
 
-from backend.models import BookPage
 
 class PdfLoader(ABC):
+  # source is either a file path or the pdf content in memory
+  @abstractmethod
+  def load_pdf(self, source: Union[str, bytes]) -> List[Page]:
+    pass
+
+  @abstractmethod
+  def iter_pages(self, source: Union[str, bytes]) -> Iterator[Page]:
+    pass
+
   @abstractmethod
-  def load_pdf(self, file_path: str) -> List[BookPage]:
+  def load_outline(self, source: Union[str, bytes]) -> List[OutlineEntry]:
     pass
@@ -0,0 +1,33 @@
+import argparse
+import os
+import time
+
+from pdf_loader.pymupdf_loader import PymupdfLoader
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description='Benchmark parallel pdf text extraction')
+  parser.add_argument('file_path')
+  parser.add_argument('--workers', type=int, nargs='+',
+                      default=sorted({1, 2, 4, os.cpu_count() or 1}))
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  baseline = None
+  for max_workers in args.workers:
+    loader = PymupdfLoader(max_workers=max_workers)
+    timings = []
+    for _ in range(args.repeat):
+      start_time = time.perf_counter()
+      pages = loader.load_pdf(args.file_path)
+      timings.append(time.perf_counter() - start_time)
+
+    best = min(timings)
+    pages_per_second = len(pages) / best
+    baseline = baseline or pages_per_second
+    print(f'workers={max_workers:>3} pages={len(pages)} best={best:.2f}s '
+          f'pages/sec={pages_per_second:.1f} speedup={pages_per_second / baseline:.2f}x')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,98 @@
+import re
+
+from typing import Dict, List, Set, Tuple
+from pydantic import BaseModel
+
+from llm_agent.token_budget import TokenCounter
+from repositories.book_content_section_repository.base import Page
+
+_WHITESPACE_PATTERN = re.compile(r'[ \t\u00a0\u3000]+')
+# Well formed roman numerals below 1000, matched in a single case so words like "civil" or "Lilac" are kept
+_ROMAN_NUMERAL = r'(?=[ivxlcd])(cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})'
+# Lines that are only a page number, e.g. "12", "- 12 -", "Page 12", "xiv", "XIV". A lone "I" is the pronoun
+_PAGE_NUMBER_PATTERN = re.compile(
+  rf'^((?i:page)\s*)?[\-–—|\s]*(\d+|{_ROMAN_NUMERAL}|(?!I\b){_ROMAN_NUMERAL.upper()})[\-–—|\s]*$')
+
+
+class PageNormalizationReport(BaseModel):
+  page_count: int
+  removed_line_count: int
+  removed_token_count: int
+
+
+class PageNormalizer:
+  """
+  Removes running headers, footers and page numbers before pages are sent to the llm. Lines that are
+  only a page number always go. Any other line is boilerplate when it shows up verbatim near the top
+  or bottom of a run of nearby pages, so a heading like "Chapter 3" or "Step 2" is kept.
+  Two linear passes over the book and no randomness, so the output is stable for caching.
+  """
+  def __init__(self, token_counter: TokenCounter, model: str = 'gpt-4o-mini',
+               edge_line_count: int = 3, min_repeat_page_count: int = 4,
+               max_repeat_page_gap: int = 2) -> None:
+    self._token_counter = token_counter
+    self._model = model
+    self._edge_line_count = edge_line_count
+    self._min_repeat_page_count = min_repeat_page_count
+    # Running headers often alternate between even and odd pages, e.g. book title and chapter title
+    self._max_repeat_page_gap = max_repeat_page_gap
+
+
+  def normalize(self, pages: List[Page]) -> Tuple[List[Page], PageNormalizationReport]:
+    page_lines = [self._split_lines(page.content) for page in pages]
+    boilerplate_lines = self._find_boilerplate_lines(page_lines)
+
+    normalized_pages = []
+    removed_lines = []
+    for page, lines in zip(pages, page_lines):
+      edge_lines = set(self._edge_line_indexes(lines))
+      kept_lines = []
+      for index, line in enumerate(lines):
+        if index in edge_lines and self._is_boilerplate(line, boilerplate_lines):
+          removed_lines.append(line)
+        else:
+          kept_lines.append(line)
+      normalized_pages.append(Page(page_num=page.page_num, content='\n'.join(kept_lines)))
+
+    return normalized_pages, PageNormalizationReport(
+      page_count=len(pages),
+      removed_line_count=len(removed_lines),
+      # Only the removed text is counted, the pages are tokenized again when packed
+      removed_token_count=self._token_counter.count('\n'.join(removed_lines), self._model))
+
+
+  def _find_boilerplate_lines(self, page_lines: List[List[str]]) -> Set[str]:
+    # Longest run of nearby pages each line was seen on, a line repeated far apart is content
+    last_page_index: Dict[str, int] = {}
+    run_length: Dict[str, int] = {}
+    boilerplate_lines = set()
+    for page_index, lines in enumerate(page_lines):
+      for line in set(self._edge_lines(lines)):
+        if page_index - last_page_index.get(line, -self._max_repeat_page_gap - 1) <= self._max_repeat_page_gap:
+          run_length[line] += 1
+        else:
+          run_length[line] = 1
+        last_page_index[line] = page_index
+        if run_length[line] >= self._min_repeat_page_count:
+          boilerplate_lines.add(line)
+    return boilerplate_lines
+
+
+  def _split_lines(self, content: str) -> List[str]:
+    lines = (_WHITESPACE_PATTERN.sub(' ', line).strip() for line in content.splitlines())
+    return [line for line in lines if line]
+
+
+  def _edge_line_indexes(self, lines: List[str]) -> List[int]:
+    # At most a third of a short page at each end, so a page of a few lines is not all edges
+    edge_count = max(1, min(self._edge_line_count, len(lines) // 3))
+    edge_count = min(edge_count, len(lines))
+    return list(range(edge_count)) + list(range(max(edge_count, len(lines) - edge_count), len(lines)))
+
+
+  def _edge_lines(self, lines: List[str]) -> List[str]:
+    return [lines[index] for index in self._edge_line_indexes(lines)]
+
+
+  def _is_boilerplate(self, line: str, boilerplate_lines: Set[str]) -> bool:
+    return bool(_PAGE_NUMBER_PATTERN.match(line)) or line in boilerplate_lines
@@ -1,16 +1,91 @@
+import multiprocessing
+import os
 import pymupdf
 
-from pdf_loader.base import PdfLoader
-from models import BookPage
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from pdf_loader.base import OutlineEntry, PdfLoader
+from repositories.book_content_section_repository.base import Page
+
+# Each worker process keeps its own handle, pymupdf documents can not be shared across processes
+_worker_doc = None
+
+
+def _open_document(source: Union[str, bytes]) -> pymupdf.Document:
+  if isinstance(source, (bytes, bytearray, memoryview)):
+    return pymupdf.open(stream=source, filetype='pdf')
+  return pymupdf.open(source)
+
+
+def _init_worker(source: Union[str, bytes]) -> None:
+  global _worker_doc
+  _worker_doc = _open_document(source)
+
+
+def _extract_document_range(doc: pymupdf.Document, page_range: Tuple[int, int]) -> List[str]:
+  start_page, end_page = page_range
+  return [doc[page_num].get_text().strip() for page_num in range(start_page, end_page)]
+
+
+def _extract_page_range(page_range: Tuple[int, int]) -> List[str]:
+  # Only run in pool workers, which hold a single document for their whole lifetime
+  return _extract_document_range(_worker_doc, page_range)
+
 
 class PymupdfLoader(PdfLoader):
-  def load_pdf(self, file_path: str) -> List[BookPage]:
-    doc = pymupdf.open(file_path)
-    pages = []
-    for page_number, page in enumerate(doc): # iterate the document pages
-      pages.append(BookPage(
-        page_num=page_number,
-        content=page.get_text().strip()))
-    return pages
+  def __init__(self, max_workers: Optional[int] = None, min_pages_per_range: int = 16,
+               ranges_per_worker: int = 4) -> None:
+    # The cores this process may run on, which can be fewer than the machine has in a container
+    self._max_workers = max_workers or len(os.sched_getaffinity(0)) or 1
+    self._min_pages_per_range = min_pages_per_range
+    self._ranges_per_worker = ranges_per_worker
+
+
+  def load_pdf(self, source: Union[str, bytes]) -> List[Page]:
+    return list(self.iter_pages(source))
+
+
+  def iter_pages(self, source: Union[str, bytes]) -> Iterator[Page]:
+    with _open_document(source) as doc:
+      page_count = doc.page_count
+
+    page_ranges = self._split_page_ranges(page_count)
+    if self._max_workers == 1 or len(page_ranges) <= 1:
+      # A local handle, the module level one is per worker process and would be shared by concurrent jobs
+      with _open_document(source) as doc:
+        yield from self._to_pages(
+          page_ranges, (_extract_document_range(doc, page_range) for page_range in page_ranges))
+      return
+
+    with ProcessPoolExecutor(
+      max_workers=min(self._max_workers, len(page_ranges)),
+      # Forking a process that runs threads (pubsub, grpc) can deadlock the children
+      mp_context=multiprocessing.get_context('forkserver'),
+      initializer=_init_worker,
+      initargs=(source,)) as executor:
+      # map keeps the submission order, so pages come back in order as soon as their range is done
+      yield from self._to_pages(page_ranges, executor.map(_extract_page_range, page_ranges))
+
+
+  def load_outline(self, source: Union[str, bytes]) -> List[OutlineEntry]:
+    with _open_document(source) as doc:
+      # Entries pointing outside the document (page -1) can not be used for sectioning
+      return [OutlineEntry(level=level, title=title, page_num=page - 1)
+              for level, title, page in doc.get_toc(simple=True)
+              if 1 <= page <= doc.page_count]
+
+
+  def _split_page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+    # Several ranges per worker so a few slow (e.g. image heavy) ranges do not stall the pool
+    range_count = self._max_workers * self._ranges_per_worker
+    range_size = max(self._min_pages_per_range, -(-page_count // range_count))
+    return [(start_page, min(start_page + range_size, page_count))
+            for start_page in range(0, page_count, range_size)]
+
 
+  def _to_pages(self, page_ranges: List[Tuple[int, int]],
+                range_texts: Iterable[List[str]]) -> Iterator[Page]:
+    for (start_page, _), texts in zip(page_ranges, range_texts):
+      for offset, text in enumerate(texts):
+        yield Page(page_num=start_page + offset, content=text)
@@ -0,0 +1,120 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Iterable, Iterator, List, Optional, Union
+
+from llm_agent.book_content_section_creater.content_section_creater import ContentSectionCreater
+from repositories.book_content_section_repository.base import BookContentSection, Page
+from repositories.book_repository.base import Book
+
+
+class _SectionReassembler:
+  """
+  Puts sectioned batches back in page order. The last section of every batch may be cut by the
+  batch boundary, so it is carried over and re-sectioned together with the first section of the
+  next batch (a "seam") on the same executor.
+  """
+  def __init__(self, executor: ThreadPoolExecutor, section_pages) -> None:
+    self._executor = executor
+    self._section_pages = section_pages
+    self._carry: Optional[List[Page]] = None
+    self._ordered: Deque[Union[List[List[Page]], Future]] = deque()
+
+
+  def add_batch(self, sections: List[List[Page]]) -> List[List[Page]]:
+    if sections and self._carry is not None:
+      self._ordered.append(self._executor.submit(self._section_pages, self._carry + sections[0]))
+      self._carry = None
+      sections = sections[1:]
+
+    if sections:
+      self._ordered.append(sections[:-1])
+      self._carry = sections[-1]
+
+    return self._pop_ready(wait=False)
+
+
+  def flush(self) -> List[List[Page]]:
+    sections = self._pop_ready(wait=True)
+    if self._carry is not None:
+      sections.append(self._carry)
+      self._carry = None
+    return sections
+
+
+  def _pop_ready(self, wait: bool) -> List[List[Page]]:
+    sections = []
+    while self._ordered:
+      head = self._ordered[0]
+      if isinstance(head, Future):
+        if not wait and not head.done():
+          break
+        head = head.result()
+      sections.extend(head)
+      self._ordered.popleft()
+    return sections
+
+
+class ContentSectionPipeline:
+  def __init__(self, content_section_creater: ContentSectionCreater,
+               max_concurrency: int = 8) -> None:
+    self._content_section_creater = content_section_creater
+    self._max_concurrency = max_concurrency
+
+
+  def iter_content_sections(self, book: Book, pages: Iterable[Page]) -> Iterator[BookContentSection]:
+    with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+      reassembler = _SectionReassembler(executor, self._section_pages)
+      pending_batches: Deque[Future] = deque()
+
+      for batch_pages in self._content_section_creater.iter_page_batches(pages):
+        pending_batches.append(executor.submit(self._section_pages, batch_pages))
+        # Backpressure on the page generator, at most one window of batches ahead of the oldest one
+        while len(pending_batches) > self._max_concurrency:
+          yield from self._to_content_sections(
+            book, reassembler.add_batch(pending_batches.popleft().result()))
+
+      while pending_batches:
+        yield from self._to_content_sections(
+          book, reassembler.add_batch(pending_batches.popleft().result()))
+      yield from self._to_content_sections(book, reassembler.flush())
+
+
+  def iter_grouped_content_sections(self, book: Book, page_groups: List[List[Page]]) -> Iterator[BookContentSection]:
+    """
+    Sections independent page groups (e.g. chapters) on one pool, no section crosses a group boundary.
+    """
+    with ThreadPoolExecutor(max_workers=self._max_concurrency) as executor:
+      group_batches = [[executor.submit(self._section_pages, batch_pages)
+                        for batch_pages in self._content_section_creater.iter_page_batches(group_pages)]
+                       for group_pages in page_groups]
+
+      for pending_batches in group_batches:
+        reassembler = _SectionReassembler(executor, self._section_pages)
+        for pending_batch in pending_batches:
+          yield from self._to_content_sections(book, reassembler.add_batch(pending_batch.result()))
+        yield from self._to_content_sections(book, reassembler.flush())
+
+
+  def _section_pages(self, pages: List[Page]) -> List[List[Page]]:
+    page_ranges = self._content_section_creater.create_content_section_from_pages(pages)
+    pages_by_num = {p.page_num: p for p in pages}
+
+    sections = []
+    used_page_nums = set()
+    for page_range in sorted(page_ranges, key=lambda r: r['start_page']):
+      section_pages = [pages_by_num[p_num]
+                       for p_num in range(page_range['start_page'], page_range['end_page'] + 1)
+                       if p_num in pages_by_num and p_num not in used_page_nums]
+      if section_pages:
+        used_page_nums.update(p.page_num for p in section_pages)
+        sections.append(section_pages)
+    return sections
+
+
+  def _to_content_sections(self, book: Book, sections: List[List[Page]]) -> Iterator[BookContentSection]:
+    for section_pages in sections:
+      yield BookContentSection(
+        book_id=book.id, user_id=book.user_id,
+        start_page=section_pages[0].page_num,
+        end_page=section_pages[-1].page_num,
+        pages=section_pages)
@@ -0,0 +1,68 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+from pdf_loader.base import OutlineEntry
+
+
+class OutlineSection(BaseModel):
+  start_page: int
+  end_page: int
+  # Oversized or not covered by the outline, these pages still go through the llm
+  needs_llm: bool = False
+
+
+class OutlineSectioner:
+  def __init__(self, min_section_pages: int = 2, max_section_pages: int = 40,
+               max_depth: int = 3, min_section_count: int = 3,
+               max_llm_page_ratio: float = 0.3) -> None:
+    self._min_section_pages = min_section_pages
+    self._max_section_pages = max_section_pages
+    self._max_depth = max_depth
+    self._min_section_count = min_section_count
+    self._max_llm_page_ratio = max_llm_page_ratio
+
+
+  def plan_sections(self, outline: List[OutlineEntry], page_count: int) -> Optional[List[OutlineSection]]:
+    """
+    Returns the sections of the book built from its outline, or None when the outline is not good
+    enough to be used and the whole book should be sectioned by the llm.
+    """
+    if not outline or page_count == 0:
+      return None
+
+    # Shallowest depth that leaves few enough pages to the llm (oversized or not covered)
+    for depth in range(1, self._max_depth + 1):
+      start_pages = sorted({e.page_num for e in outline if e.level <= depth})
+      if len(start_pages) < self._min_section_count:
+        continue
+
+      sections = self._build_sections(start_pages, page_count)
+      if self._llm_page_ratio(sections, page_count) <= self._max_llm_page_ratio:
+        return sections
+
+    return None
+
+
+  def _build_sections(self, start_pages: List[int], page_count: int) -> List[OutlineSection]:
+    sections = []
+    # Front matter before the first outline entry
+    if start_pages[0] > 0:
+      sections.append(OutlineSection(start_page=0, end_page=start_pages[0] - 1, needs_llm=True))
+
+    end_pages = [p - 1 for p in start_pages[1:]] + [page_count - 1]
+    for start_page, end_page in zip(start_pages, end_pages):
+      # Short sections (e.g. part title pages) are merged into the following one
+      if (sections and not sections[-1].needs_llm and
+          sections[-1].end_page - sections[-1].start_page + 1 < self._min_section_pages):
+        sections[-1].end_page = end_page
+      else:
+        sections.append(OutlineSection(start_page=start_page, end_page=end_page))
+
+    for section in sections:
+      if section.end_page - section.start_page + 1 > self._max_section_pages:
+        section.needs_llm = True
+    return sections
+
+
+  def _llm_page_ratio(self, sections: List[OutlineSection], page_count: int) -> float:
+    return sum(s.end_page - s.start_page + 1 for s in sections if s.needs_llm) / page_count
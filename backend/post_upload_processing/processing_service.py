@@ -1,40 +1,83 @@
 
-import tempfile
+import hashlib
+import heapq
+from datetime import datetime, timezone
 from pydantic import BaseModel
-import pymupdf
 import logging
 
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 
 
 from file_service.base import FileService
-from llm_agent.book_content_section_creater.content_section_creater import ContentSectionCreater
+from message_broker.fair_job_queue import FairJobGate, FairJobQueue
 from message_broker.pubsub_message_broker import MessageBroker
-from repositories.book_content_section_repository.base import BookContentSection, BookContentSectionRepository, Page
+from page_store.base import PageStore
+from pdf_loader.base import PdfLoader
+from pdf_loader.page_normalizer import PageNormalizer
+from post_upload_processing.content_section_pipeline import ContentSectionPipeline
+from post_upload_processing.outline_sectioner import OutlineSectioner
+from repositories.book_content_index_repository.base import BookContentIndex, BookContentIndexRepository
+from repositories.book_content_section_repository.base import BookContentSection, BookContentSectionRepository
+from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus
 from repositories.book_repository.base import Book, BookRepository
 
 class PostProcessingJob(BaseModel):
   book_id: str
-  
+  # Tenant of the job for fair scheduling, unset on jobs published before it existed
+  user_id: Optional[str] = None
+  is_premium: bool = False
+
+
 class ProcessingService:
   def __init__(self, message_broker: MessageBroker, 
                file_service: FileService, 
                book_repository: BookRepository,
                book_content_section_repository: BookContentSectionRepository,
-               content_section_creater:ContentSectionCreater) -> None:
+               book_distilled_page_repository: BookDistilledPageRepository,
+               book_content_index_repository: BookContentIndexRepository,
+               content_section_pipeline: ContentSectionPipeline,
+               outline_sectioner: OutlineSectioner,
+               pdf_loader: PdfLoader,
+               page_normalizer: PageNormalizer,
+               page_store: PageStore,
+               checkpoint_section_count: int = 10,
+               max_concurrency: int = 2,
+               max_in_flight_per_user: int = 1,
+               max_pending_per_user: int = 1,
+               premium_weight: float = 2.0,
+               max_pending_jobs: int = 20) -> None:
     self._message_broker = message_broker
     self._file_service = file_service
     self._book_repository = book_repository
     self._book_content_section_repository = book_content_section_repository
-    self._content_section_creater = content_section_creater
+    self._book_distilled_page_repository = book_distilled_page_repository
+    self._book_content_index_repository = book_content_index_repository
+    self._content_section_pipeline = content_section_pipeline
+    self._outline_sectioner = outline_sectioner
+    self._pdf_loader = pdf_loader
+    self._page_normalizer = page_normalizer
+    self._page_store = page_store
+    self._checkpoint_section_count = checkpoint_section_count
+    # Jobs delivered ahead of the running ones, leased and waiting for their turn
+    self._max_pending_jobs = max_pending_jobs
+    # One user uploading many books only delays the others by their share of the workers
+    self._job_gate = FairJobGate(FairJobQueue(
+      tenant_key=lambda job: job.user_id or job.book_id,
+      tenant_weight=lambda job: premium_weight if job.is_premium else 1.0,
+      max_in_flight_per_tenant=max_in_flight_per_user,
+      # More jobs of a user are deferred, their leases would keep other users' jobs from being delivered
+      max_pending_per_tenant=max_pending_per_user), max_running=max_concurrency)
 
 
   def start(self) -> None:
-    while True:
-      job = self._message_broker.get_next_job()
-      if job is None:
-        logging.info("No job to process")
-        continue
+    self._message_broker.subscribe(self._handle_job, self._max_pending_jobs).result()
+
+
+  def _handle_job(self, job: PostProcessingJob) -> None:
+    with self._job_gate.turn(job) as accepted:
+      if not accepted:
+        logging.info(f"Job already pending or running: {job.model_dump_json()}")
+        return
 
       logging.info(f"Processing job: {job.model_dump_json()}")
       self._process_job(job)
@@ -42,54 +85,118 @@ class ProcessingService:
 
 
   def _process_job(self, job: PostProcessingJob) -> None:
-    with tempfile.TemporaryDirectory() as temp_dir:
-      temp_file_path = f'{temp_dir}/{job.book_id}'
-      self._file_service.download_to_destination(job.book_id, temp_file_path)
+    # Check the metadata before any bytes are downloaded
+    book = self._book_repository.get_by_book_id(job.book_id)
+    if book.content_section_generated:
+      logging.info(f"Content section already generated for book: {job.book_id}")
+      return
+
+    if book.last_sectioned_page >= 0:
+      logging.info(f"Resuming book: {job.book_id} after page: {book.last_sectioned_page}")
+
+    book_data = self._file_service.download_as_bytes(job.book_id)
+    book.content_hash = hashlib.sha256(book_data).hexdigest()
+    content_index = self._book_content_index_repository.get(book.content_hash)
+    if content_index and content_index.book_id != book.id:
+      logging.info(f"Reusing content of book: {content_index.book_id} for book: {job.book_id}")
+      content_sections = self._clone_content(content_index, book)
+    elif book.type == "pdf":
+      content_sections = self._process_pdf(book_data, book)
+
+    self._save_with_checkpoints(book, content_sections)
+
+    book.content_section_generated = True
+    self._book_repository.save(book)
+    if not content_index:
+      self._book_content_index_repository.save(BookContentIndex(
+        content_hash=book.content_hash, book_id=book.id, user_id=book.user_id,
+        created_datetime=datetime.now(timezone.utc)))
+
+
+  def _save_with_checkpoints(self, book: Book, content_sections: Iterable[BookContentSection]) -> None:
+    # Sections are persisted in page order as they are produced, the book keeps the last page
+    # persisted so a redelivered job continues from there
+    checkpoint_sections = []
+    for content_section in content_sections:
+      if content_section.end_page <= book.last_sectioned_page:
+        continue
 
-      book = self._book_repository.get_by_book_id(job.book_id)
-      if book.content_section_generated:
-        logging.info(f"Content section already generated for book: {job.book_id}")
-        return
-      
-      if book.type == "pdf":
-        all_content_sections = self._process_pdf(temp_file_path, book)
-      
-      # TODO: Wrap in transaction
-      book.content_section_generated = True
-      self._book_content_section_repository.save_multiple(all_content_sections)
-      self._book_repository.save(book)
-
-
-  def _process_pdf(self, temp_file_path: str, book: Book) -> List[Page]:
-    BATCH_PAGE_COUNT = 50
-    BATCH_TOKEN_COUNT = 20000
-
-    batch_page = []
-    batch_token_count = 0
-    all_content_sections = []
-
-    doc = pymupdf.open(temp_file_path)
-    for page_number, page in enumerate(doc): # iterate the document pages
-      book_page = Page(
-        page_num=page_number,
-        content=page.get_text().strip())
-      
-      batch_page.append(book_page)
-      batch_token_count += len(page.get_text()) / 4
-
-      if (len(batch_page) == BATCH_PAGE_COUNT or 
-          batch_token_count >= BATCH_TOKEN_COUNT):
-        
-        batch_page_dict = {p.page_num:p for p in batch_page}
-        page_ranges = self._content_section_creater.create_content_section_from_pages(batch_page)
-        for page_range in page_ranges:
-          book_content_section = BookContentSection(
-            book_id=book.id, user_id=book.user_id,
-            start_page=page_range['start_page'],
-            end_page=page_range['end_page'],
-            pages=[batch_page_dict[p_num] for p_num in range(page_range['start_page'], page_range['end_page']+1)])
-          all_content_sections.append(book_content_section)
-        
-        batch_page = []
-        batch_token_count = 0
-    return all_content_sections
\ No newline at end of file
+      checkpoint_sections.append(content_section)
+      if len(checkpoint_sections) >= self._checkpoint_section_count:
+        self._save_checkpoint(book, checkpoint_sections)
+        checkpoint_sections = []
+
+    if checkpoint_sections:
+      self._save_checkpoint(book, checkpoint_sections)
+
+
+  def _save_checkpoint(self, book: Book, content_sections: List[BookContentSection]) -> None:
+    # Sections are written under their range, a checkpoint retried after a crash before the book is
+    # saved overwrites the same documents
+    self._book_content_section_repository.save_multiple(content_sections)
+    book.last_sectioned_page = content_sections[-1].end_page
+    self._book_repository.save(book)
+
+
+  def _clone_content(self, content_index: BookContentIndex, book: Book) -> List[BookContentSection]:
+    # Copies are owned by the new book and user, the source records are left untouched
+    content_sections = sorted([
+      content_section.model_copy(update={'book_id': book.id, 'user_id': book.user_id})
+      for content_section in self._book_content_section_repository.get_all(
+        content_index.book_id, content_index.user_id)], key=lambda s: s.start_page)
+    self._page_store.save_pages(
+      book.id, [page for content_section in content_sections for page in content_section.pages])
+
+    if book.last_sectioned_page < 0:
+      distilled_pages = [
+        distilled_page.model_copy(update={'book_id': book.id, 'user_id': book.user_id})
+        for distilled_page in self._book_distilled_page_repository.get_all(
+          content_index.book_id, content_index.user_id)
+        if distilled_page.processing_status == ProcessingStatus.COMPLETED]
+      if distilled_pages:
+        self._book_distilled_page_repository.save_multiple(distilled_pages)
+
+    return content_sections
+
+
+  def _process_pdf(self, book_data: bytes, book: Book) -> Iterator[BookContentSection]:
+    # Boilerplate detection needs the line frequencies of the whole book
+    pages, report = self._page_normalizer.normalize(self._pdf_loader.load_pdf(book_data))
+    logging.info(f"Normalized pages of book: {book.id}, removed {report.removed_line_count} lines, "
+                 f"{report.removed_token_count} tokens")
+
+    # Page text is written once per book, section documents only reference page ranges
+    self._page_store.save_pages(book.id, pages)
+
+    outline_sections = self._outline_sectioner.plan_sections(
+      self._pdf_loader.load_outline(book_data), len(pages))
+    if outline_sections is None:
+      return self._content_section_pipeline.iter_content_sections(
+        book, pages[book.last_sectioned_page + 1:])
+
+    # Outline sections are used as is, only oversized or uncovered ranges are sent to the llm
+    content_sections = []
+    llm_page_groups = []
+    for outline_section in outline_sections:
+      if outline_section.end_page <= book.last_sectioned_page:
+        continue
+
+      # A checkpoint can land inside an llm page range, only its remaining pages are sectioned again
+      start_page = max(outline_section.start_page, book.last_sectioned_page + 1)
+      section_pages = pages[start_page:outline_section.end_page + 1]
+      if outline_section.needs_llm:
+        llm_page_groups.append(section_pages)
+      else:
+        content_sections.append(BookContentSection(
+          book_id=book.id, user_id=book.user_id,
+          start_page=start_page,
+          end_page=outline_section.end_page,
+          pages=section_pages))
+
+    logging.info(f"Sectioned book: {book.id} from its outline, "
+                 f"{len(llm_page_groups)} page ranges left to the llm")
+    # merge pulls the first llm section right away, so the llm calls start before anything is saved
+    return heapq.merge(
+      content_sections,
+      self._content_section_pipeline.iter_grouped_content_sections(book, llm_page_groups),
+      key=lambda s: s.start_page)
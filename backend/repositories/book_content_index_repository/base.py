@@ -0,0 +1,21 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pydantic import BaseModel
+
+
+class BookContentIndex(BaseModel):
+  content_hash: str
+  # Book whose extracted pages, content sections and distilled pages are reused for identical uploads
+  book_id: str
+  user_id: str
+  created_datetime: datetime
+
+
+class BookContentIndexRepository(ABC):
+  @abstractmethod
+  def save(self, book_content_index: BookContentIndex) -> None:
+    pass
+
+  @abstractmethod
+  def get(self, content_hash: str) -> BookContentIndex:
+    pass
@@ -0,0 +1,21 @@
+from google.cloud import firestore
+
+from repositories.book_content_index_repository.base import BookContentIndex, BookContentIndexRepository
+
+
+class FirebaseBookContentIndexRepository(BookContentIndexRepository):
+  def __init__(self, firebase_client: firestore.Client, collection_name:str):
+    self._client = firebase_client
+    self._collection_name = collection_name
+    self._collection = self._client.collection(
+    self._collection_name)
+
+  def save(self, book_content_index: BookContentIndex) -> None:
+    self._collection.document(book_content_index.content_hash).set(book_content_index.model_dump())
+
+  def get(self, content_hash: str) -> BookContentIndex:
+    doc = self._collection.document(content_hash).get()
+    if not doc.exists:
+      return None
+
+    return BookContentIndex.model_validate(doc.to_dict())
@@ -28,11 +28,13 @@ class BookContentSectionRepository(ABC):
     pass
 
   @abstractmethod
-  def get_by_page(self, book_id:str, page_num:int, user_id:str = None) -> BookContentSection:
+  def get_by_page(self, book_id:str, page_num:int, user_id:str = None,
+                  exclude_pages:bool = False) -> BookContentSection:
     pass
 
   @abstractmethod
-  def get_by_range(self, book_id:str, start_page:int, end_page:int, user_id:str = None) -> BookContentSection:
+  def get_by_range(self, book_id:str, start_page:int, end_page:int, user_id:str = None,
+                   exclude_pages:bool = False) -> BookContentSection:
     pass
 
   @abstractmethod
@@ -1,35 +1,40 @@
-from typing import List
+from typing import List, Optional
 from google.cloud import firestore
 
+from page_store.base import PageStore
 from repositories.book_content_section_repository.base import BookContentSection, BookContentSectionRepository
 
 class FirebaseBookContentSectionRepository(BookContentSectionRepository):
-  def __init__(self, firebase_client: firestore.Client, collection_name:str):
+  def __init__(self, firebase_client: firestore.Client, collection_name:str,
+               page_store: Optional[PageStore] = None):
     self._client = firebase_client
     self._collection_name = collection_name
     self._collection = self._client.collection(
     self._collection_name)
+    # Page text lives in the page store when configured, documents only keep the page range
+    self._page_store = page_store
 
 
   def save(self, book_content_section: BookContentSection) -> None:
-    self._collection.document(book_content_section.id).set(book_content_section.model_dump())
+    self._get_document(book_content_section).set(self._to_document(book_content_section))
 
 
   def save_multiple(self, book_content_sections: List[BookContentSection]) -> None:
     # Batch write
     batch = self._client.batch()
     for book_content_section in book_content_sections:
-      batch.set(self._collection.document(), book_content_section.model_dump())
+      batch.set(self._get_document(book_content_section), self._to_document(book_content_section))
     batch.commit()
   
 
   def get_by_book_id(self, book_id:str) -> List[BookContentSection]:
     docs = self._collection.where(
       'book_id', '==', book_id).get()
-    return [BookContentSection(**doc.to_dict()) for doc in docs]
+    return self._load_pages([BookContentSection(**doc.to_dict()) for doc in docs])
 
 
-  def get_by_page(self, book_id:str, page_num:int, user_id:str = None) -> BookContentSection:
+  def get_by_page(self, book_id:str, page_num:int, user_id:str = None,
+                  exclude_pages:bool = False) -> BookContentSection:
     if user_id:
       docs = self._collection.where(
         'book_id', '==', book_id).where(
@@ -44,10 +49,12 @@ class FirebaseBookContentSectionRepository(BookContentSectionRepository):
     if not docs:
       return None
     
-    return BookContentSection(**docs[0].to_dict())
+    content_section = BookContentSection(**docs[0].to_dict())
+    return content_section if exclude_pages else self._load_pages([content_section])[0]
   
 
-  def get_by_range(self, book_id:str, start_page:int, end_page:int, user_id:str = None) -> BookContentSection:
+  def get_by_range(self, book_id:str, start_page:int, end_page:int, user_id:str = None,
+                   exclude_pages:bool = False) -> BookContentSection:
     if user_id:
       docs = self._collection.where(
         'book_id', '==', book_id).where(
@@ -62,7 +69,8 @@ class FirebaseBookContentSectionRepository(BookContentSectionRepository):
     if not docs:
       return None
     
-    return BookContentSection(**docs[0].to_dict())
+    content_section = BookContentSection(**docs[0].to_dict())
+    return content_section if exclude_pages else self._load_pages([content_section])[0]
 
 
   def get_all(self, book_id:str, user_id:str = None, exclude_pages:bool = False) -> List[BookContentSection]:
@@ -78,4 +86,39 @@ class FirebaseBookContentSectionRepository(BookContentSectionRepository):
       else:
         docs = self._collection.where('book_id', '==', book_id).get()
     
-    return [BookContentSection.model_validate(doc.to_dict()) for doc in docs]
\ No newline at end of file
+    content_sections = [BookContentSection.model_validate(doc.to_dict()) for doc in docs]
+    return content_sections if exclude_pages else self._load_pages(content_sections)
+
+
+  def _get_document(self, book_content_section: BookContentSection) -> firestore.DocumentReference:
+    # One id per range, so writing a section again overwrites it instead of adding a copy
+    return self._collection.document(
+      f'{book_content_section.book_id}_{book_content_section.start_page}_{book_content_section.end_page}')
+
+
+  def _to_document(self, book_content_section: BookContentSection) -> dict:
+    if self._page_store:
+      return book_content_section.model_dump(exclude={'pages'})
+    return book_content_section.model_dump()
+
+
+  def _load_pages(self, content_sections: List[BookContentSection]) -> List[BookContentSection]:
+    # Sections written before the page store keep their pages inline
+    missing = [s for s in content_sections if not s.pages]
+    if not self._page_store or not missing:
+      return content_sections
+
+    pages_by_book = {}
+    for content_section in missing:
+      pages_by_book.setdefault(content_section.book_id, []).append(content_section)
+
+    for book_id, book_sections in pages_by_book.items():
+      # One ranged read covering every requested section of the book
+      pages = self._page_store.get_pages(
+        book_id,
+        min(s.start_page for s in book_sections),
+        max(s.end_page for s in book_sections))
+      for content_section in book_sections:
+        content_section.pages = [p for p in pages
+                                 if content_section.start_page <= p.page_num <= content_section.end_page]
+    return content_sections
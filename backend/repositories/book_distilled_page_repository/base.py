@@ -1,11 +1,13 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 
 class ProcessingStatus(str, Enum):
   IN_PROGRESS = "IN_PROGRESS"
+  # Paragraphs streamed so far, the distillation is still running
+  PARTIAL = "PARTIAL"
   COMPLETED = "COMPLETED"
 
 class DistilledPageParagraph(BaseModel):
@@ -22,6 +24,31 @@ class DistilledPage(BaseModel):
   paragraphs:list[DistilledPageParagraph]
   created_datetime:datetime
   processing_status:ProcessingStatus
+  # Priority of the job queued for the page, while it waits to be picked up
+  priority:Optional[str] = None
+  # Holder of the page's distillation, the api while its job is queued and then the worker running it
+  lease_owner:Optional[str] = None
+  lease_expiry:Optional[datetime] = None
+
+
+class LeaseLostError(Exception):
+  pass
+
+
+def can_acquire_lease(distilled_page: DistilledPage, owner: str, expected_owner: Optional[str] = None) -> bool:
+  """
+  A lease is acquired by its current owner, by the expected owner's successor, or by anyone once it
+  has expired. Completed pages need no lease.
+  """
+  if distilled_page.processing_status == ProcessingStatus.COMPLETED:
+    return False
+  if distilled_page.lease_owner is None or distilled_page.lease_owner in (owner, expected_owner):
+    return True
+  return distilled_page.lease_expiry is None or distilled_page.lease_expiry <= datetime.now(timezone.utc)
+
+
+def get_lease_expiry(lease_seconds: float) -> datetime:
+  return datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
 
 
 class BookDistilledPageRepository(ABC):
@@ -29,6 +56,44 @@ class BookDistilledPageRepository(ABC):
   def save(self, distilled_page: DistilledPage) -> None:
     pass
 
+  @abstractmethod
+  def save_multiple(self, distilled_pages: List[DistilledPage]) -> None:
+    pass
+
+  @abstractmethod
+  def create_if_absent(self, distilled_page: DistilledPage) -> bool:
+    """
+    Atomically creates the page unless one exists for its range, returns whether it was created.
+    """
+    pass
+
+  @abstractmethod
+  def acquire_lease(self, book_id: str, start_page: int, end_page: int, owner: str, lease_seconds: float,
+                    expected_owner: Optional[str] = None) -> Optional[DistilledPage]:
+    """
+    Atomically sets the lease of an existing page when can_acquire_lease allows it, also used by the
+    owner to heartbeat. Returns the updated page, None when the lease is held by someone else.
+    """
+    pass
+
+  @abstractmethod
+  def save_if_leased(self, distilled_page: DistilledPage, owner: str) -> bool:
+    """
+    Atomically saves the page only while owner holds its lease, returns whether it was saved.
+    """
+    pass
+
   @abstractmethod
   def get(self, book_id: str, start_page: int, end_page: int, user_id:str = None) -> DistilledPage:
+    pass
+
+  @abstractmethod
+  def get_all(self, book_id: str, user_id:str = None) -> List[DistilledPage]:
+    pass
+
+  @abstractmethod
+  def get_unfinished_by_user(self, user_id: str) -> List[DistilledPage]:
+    """
+    Pages not completed yet across every book of the user.
+    """
     pass
\ No newline at end of file
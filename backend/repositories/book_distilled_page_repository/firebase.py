@@ -1,5 +1,10 @@
+from typing import List, Optional
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import firestore
-from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage
+from repositories.book_distilled_page_repository.base import BookDistilledPageRepository, DistilledPage, ProcessingStatus, can_acquire_lease, get_lease_expiry
+
+# Firestore rejects batches of more than 500 writes
+_MAX_BATCH_SIZE = 500
 
 
 class FirebaseBookDistilledPageRepository(BookDistilledPageRepository):
@@ -24,7 +29,61 @@ class FirebaseBookDistilledPageRepository(BookDistilledPageRepository):
       return
 
     # If no existing document found, create new one
-    self._collection.document().set(distilled_page.model_dump())
+    self._get_document(distilled_page).set(distilled_page.model_dump())
+
+  def save_multiple(self, distilled_pages: List[DistilledPage]) -> None:
+    # Batch write, only meant for pages that do not exist yet
+    for start in range(0, len(distilled_pages), _MAX_BATCH_SIZE):
+      batch = self._client.batch()
+      for distilled_page in distilled_pages[start:start + _MAX_BATCH_SIZE]:
+        batch.set(self._get_document(distilled_page), distilled_page.model_dump())
+      batch.commit()
+
+  def create_if_absent(self, distilled_page: DistilledPage) -> bool:
+    # Documents created before ids were derived from the range are only found by query
+    if self.get(distilled_page.book_id, distilled_page.start_page, distilled_page.end_page):
+      return False
+
+    try:
+      self._get_document(distilled_page).create(distilled_page.model_dump())
+    except AlreadyExists:
+      return False
+    return True
+
+  def acquire_lease(self, book_id: str, start_page: int, end_page: int, owner: str, lease_seconds: float,
+                    expected_owner: Optional[str] = None) -> Optional[DistilledPage]:
+    query = self._get_range_query(book_id, start_page, end_page)
+
+    @firestore.transactional
+    def acquire(transaction: firestore.Transaction) -> Optional[DistilledPage]:
+      docs = query.get(transaction=transaction)
+      if not docs:
+        return None
+
+      distilled_page = DistilledPage(**docs[0].to_dict())
+      if not can_acquire_lease(distilled_page, owner, expected_owner):
+        return None
+
+      distilled_page = distilled_page.model_copy(update={
+        'lease_owner': owner, 'lease_expiry': get_lease_expiry(lease_seconds)})
+      transaction.update(docs[0].reference, {
+        'lease_owner': distilled_page.lease_owner, 'lease_expiry': distilled_page.lease_expiry})
+      return distilled_page
+
+    return acquire(self._client.transaction())
+
+  def save_if_leased(self, distilled_page: DistilledPage, owner: str) -> bool:
+    query = self._get_range_query(distilled_page.book_id, distilled_page.start_page, distilled_page.end_page)
+
+    @firestore.transactional
+    def save(transaction: firestore.Transaction) -> bool:
+      docs = query.get(transaction=transaction)
+      if not docs or docs[0].to_dict().get('lease_owner') != owner:
+        return False
+      transaction.set(docs[0].reference, distilled_page.model_dump())
+      return True
+
+    return save(self._client.transaction())
 
   def get(self, book_id: str, start_page: int, end_page: int, user_id:str = None) -> DistilledPage:
     if user_id: 
@@ -46,4 +105,34 @@ class FirebaseBookDistilledPageRepository(BookDistilledPageRepository):
     if not docs:
       return None
     
-    return DistilledPage(**docs[0].to_dict())
\ No newline at end of file
+    return DistilledPage(**docs[0].to_dict())
+
+  def get_all(self, book_id: str, user_id:str = None) -> List[DistilledPage]:
+    if user_id:
+      docs = (self._collection
+              .where('book_id', '==', book_id)
+              .where('user_id', '==', user_id)
+              .get())
+    else:
+      docs = self._collection.where('book_id', '==', book_id).get()
+
+    return [DistilledPage(**doc.to_dict()) for doc in docs]
+
+  def get_unfinished_by_user(self, user_id: str) -> List[DistilledPage]:
+    docs = (self._collection
+            .where('user_id', '==', user_id)
+            .where('processing_status', 'in', [ProcessingStatus.IN_PROGRESS.value, ProcessingStatus.PARTIAL.value])
+            .get())
+    return [DistilledPage(**doc.to_dict()) for doc in docs]
+
+  def _get_document(self, distilled_page: DistilledPage) -> firestore.DocumentReference:
+    # One id per range, so concurrent creates of the same range conflict
+    return self._collection.document(
+      f'{distilled_page.book_id}_{distilled_page.start_page}_{distilled_page.end_page}')
+
+  def _get_range_query(self, book_id: str, start_page: int, end_page: int) -> firestore.Query:
+    return (self._collection
+        .where('book_id', '==', book_id)
+        .where('start_page', '==', start_page)
+        .where('end_page', '==', end_page)
+        .limit(1))
\ No newline at end of file
@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 
 
@@ -12,6 +12,9 @@ class Book(BaseModel):
   created_datetime: datetime
   is_uploaded: bool = False
   content_section_generated: bool = False
+  content_hash: Optional[str] = None
+  # Content sections up to and including this page are persisted, -1 when none are
+  last_sectioned_page: int = -1
 
 
 class BookRepository(ABC):